@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 """Usage: ghdecoy.py [ARGS] CMD
+       ghdecoy.py [ARGS] --batch FILE
 
   ARGS:
   -h|--help    : display this help message
@@ -8,6 +9,11 @@
   -s           : push over ssh instead of https
   -v|--version : print version information and exit
   -w           : only create commits on working days (Mo-Fr)
+  --holidays FILE : never create commits on the dates or date ranges
+                 listed in FILE
+  -b BACKEND   : build the repository using BACKEND. Valid values are
+                 script (default), compact, fast-import, pack and
+                 plumbing.
   -d DIR       : directory to craft the the fake repository in (default: /tmp)
   -l LANG      : make decoy repo look like language LANG
   -m COUNT     : only fill gaps of at least COUNT days (default: 5)
@@ -15,6 +21,39 @@
   -p NUM       : sets the darkest shade of contribution 'pixels' to be
                  created to NUM. Valid values are 1-4 (default: 4).
   -u USER      : use the username USER instead of the current unix user
+  --bundle     : write the history to DIR/REPO.bundle instead of pushing it
+  --push-chunk NUM : push the history in chunks of NUM commits. With -k an
+                 interrupted push is resumed by running ghdecoy again.
+  --seed-salt SALT : change the random pattern; the same user, repository
+                 and SALT always create the same commits (default: '')
+  --incremental : keep the repository in DIR between runs, only add commits
+                 for days it does not cover yet and push them without
+                 rewriting the existing history
+  --variants NUM : only use NUM different file contents for all commits
+                 instead of a new one per commit (valid values: 2 or more)
+  --compact-history : with --incremental, remove all commits older than the
+                 calendar from the repository before adding new ones
+  --estimate   : only print the number of commits and the predicted build
+                 time and push size instead of creating the repository
+  --planner PLANNER : how the number of commits per day is chosen. Valid
+                 values are scale (default) and shade.
+  --batch FILE : process several users; every line of FILE ('-' for stdin)
+                 holds the arguments and CMD for one user. ARGS given on
+                 the command line apply to all users.
+  --jobs NUM   : process up to NUM users in parallel in batch mode
+                 (default: 4)
+  --base-url URL : fetch contribution data from URL instead of
+                 https://github.com
+  --fetch-jobs NUM : fetch up to NUM calendars in parallel in batch mode
+                 (default: 8)
+  --timeout SECS : network timeout for fetching calendars (default: 30)
+  --cache-dir DIR : cache fetched calendars in DIR
+  --cache-ttl SECS : use cached calendars younger than SECS without
+                 revalidating them (default: 3600)
+  --cache-max-age SECS : remove cached calendars older than SECS
+                 (default: 604800)
+  --cache-max-size BYTES : keep the cache below BYTES by removing the
+                 oldest entries (default: 104857600)
 
   CMD          : one of the following:
                  fill   : fill all occurrences of 5 or more consecutive
@@ -23,17 +62,35 @@
                           after the last existing commit
                  DATE[-DATE][,...] : fill only the given date(s). Overrides
                           '-m'. See man page for examples.
+                 @FILE  : same as above with the dates read from FILE
+                 -      : same as above with the dates read from stdin
 """
 
+import binascii
 import getopt
-import sys
+import hashlib
+import httplib
+import json
+import multiprocessing
+import multiprocessing.pool
 import os
-import urllib2
-import re
 import random
-import subprocess
+import re
+import shlex
 import shutil
-from datetime import datetime, timedelta
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib
+import urlparse
+import zlib
+from array import array
+from datetime import date, datetime, timedelta
+from itertools import compress
 
 __version__ = '0.5.0'
 
@@ -180,6 +237,26 @@ content_templates = {
 
 known_languages = content_templates.keys()
 
+known_backends = ['script', 'compact', 'fast-import', 'pack', 'plumbing']
+
+script_backends = ['script', 'compact']
+
+known_planners = ['scale', 'shade']
+
+pack_types = {'commit': 1, 'tree': 2, 'blob': 3}
+
+calendar_re = re.compile(
+    r'(?:data|js)-(?:(calendar-graph-svg)|'
+    r'count="(\d+)"[^<>]*?data-date="(\d{4}-\d\d-\d\d)"|'
+    r'date="(\d{4}-\d\d-\d\d)"[^<>]*?data-count="(\d+)")')
+calendar_min_days = 365
+calendar_max_days = 371
+
+echo_re = re.compile(r"^echo (?:'(.*)'|(\S*)) >>? \S+$")
+
+date_entry_re = re.compile(
+    r'(\d{4})-?(\d\d)-?(\d\d)(?:(?:-|\.\.|/)(\d{4})-?(\d\d)-?(\d\d))?$')
+
 
 def usage():
     """Prints the usage message."""
@@ -193,44 +270,584 @@ def version():
     print "ghdecoy.py {}".format(__version__)
 
 
-def get_calendar(user):
+class CalendarCache(object):
+    """Stores fetched calendars on disk together with their validators.
+
+    Every user has a data file holding the raw response and a meta file
+    holding the time it was fetched and the ETag and Last-Modified headers.
+    """
+
+    def __init__(self, path, ttl=3600, max_age=604800, max_size=104857600):
+        self.path = path
+        self.ttl = ttl
+        self.max_age = max_age
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def get_paths(self, user):
+        """Returns the paths of the data and meta files of a user."""
+
+        name = os.path.join(self.path, urllib.quote(user, ''))
+        return name + '.html', name + '.json'
+
+    def get(self, user):
+        """Returns the cached data and meta data of a user.
+
+        Both are None if the user is not cached.
+        """
+
+        data_path, meta_path = self.get_paths(user)
+        try:
+            with open(meta_path) as meta_fo:
+                meta = json.load(meta_fo)
+            with open(data_path, 'rb') as data_fo:
+                data = data_fo.read()
+        except (IOError, ValueError):
+            return None, None
+        return data, meta
+
+    def is_fresh(self, meta):
+        """Checks whether cached data may be used without revalidation."""
+
+        return time.time() - meta['fetched'] < self.ttl
+
+    def get_tmp_path(self, path):
+        """Returns a temporary path unique to this thread for path."""
+
+        return '{0}.{1}.{2}.tmp'.format(path, os.getpid(),
+                                        threading.current_thread().ident)
+
+    def write(self, path, data):
+        """Atomically replaces the file at path with data."""
+
+        tmp_path = self.get_tmp_path(path)
+        with open(tmp_path, 'wb') as tmp_fo:
+            tmp_fo.write(data)
+        os.rename(tmp_path, path)
+
+    def open_data(self, user):
+        """Returns a temporary file for writing the data of a user.
+
+        Once complete, it is moved into place by passing it to put().
+        """
+
+        return open(self.get_tmp_path(self.get_paths(user)[0]), 'wb')
+
+    def put(self, user, data, meta, data_file=None):
+        """Stores the data and meta data of a user.
+
+        Instead of the data itself, the name of a file returned by
+        open_data() may be given as data_file. Old entries are not evicted
+        here as that requires a scan of the whole cache; call evict() once
+        all calendars have been stored.
+        """
+
+        data_path, meta_path = self.get_paths(user)
+        meta = dict(meta, fetched=time.time())
+        if data_file is not None:
+            os.rename(data_file, data_path)
+        elif data is not None:
+            self.write(data_path, data)
+        self.write(meta_path, json.dumps(meta))
+
+    def evict(self):
+        """Removes entries older than max_age and keeps below max_size."""
+
+        with self.lock:
+            entries = []
+            now = time.time()
+            for name in os.listdir(self.path):
+                if not name.endswith('.json'):
+                    continue
+                meta_path = os.path.join(self.path, name)
+                data_path = meta_path[:-len('.json')] + '.html'
+                try:
+                    mtime = os.path.getmtime(meta_path)
+                    size = (os.path.getsize(meta_path) +
+                            os.path.getsize(data_path))
+                except OSError:
+                    continue
+                entries.append((mtime, size, data_path, meta_path))
+
+            entries.sort()
+            total = sum(entry[1] for entry in entries)
+            for mtime, size, data_path, meta_path in entries:
+                if now - mtime <= self.max_age and total <= self.max_size:
+                    break
+                for path in (meta_path, data_path):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                total -= size
+
+
+class Decompressor(object):
+    """Incrementally decodes a gzip or deflate encoded response body.
+
+    Servers disagree on whether 'deflate' means zlib wrapped or raw deflate
+    data, so raw data is assumed if the first chunk has no zlib header.
+    """
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self.started = False
+        if encoding == 'gzip':
+            self.obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            self.obj = zlib.decompressobj(zlib.MAX_WBITS)
+
+    def decompress(self, chunk):
+        """Returns the decoded data of the next chunk."""
+
+        if self.started or self.encoding == 'gzip':
+            return self.obj.decompress(chunk)
+        self.started = True
+        try:
+            return self.obj.decompress(chunk)
+        except zlib.error:
+            self.obj = zlib.decompressobj(-zlib.MAX_WBITS)
+            return self.obj.decompress(chunk)
+
+    def flush(self):
+        """Returns any data still buffered by the decompressor."""
+
+        return self.obj.flush()
+
+
+class CalendarFetcher(object):
+    """Fetches contribution calendars over persistent HTTP connections.
+
+    Every thread keeps its own keep-alive connection per host, so fetching
+    many calendars only opens as many connections as there are threads.
+    Responses are requested compressed and decoded on the fly; the number of
+    bytes received and the number of bytes after decoding are counted in
+    wire_bytes and data_bytes.
+    """
+
+    max_redirects = 5
+
+    def __init__(self, base_url='https://github.com', timeout=30, cache=None):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.cache = cache
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.wire_bytes = 0
+        self.data_bytes = 0
+
+    def get_url(self, user):
+        """Returns the URL of the given user's contribution data."""
+
+        return self.base_url + '/users/' + user + '/contributions'
+
+    def get_connection(self, scheme, netloc):
+        """Returns this thread's connection to the given host."""
+
+        if not hasattr(self.local, 'connections'):
+            self.local.connections = {}
+        key = (scheme, netloc)
+        if key not in self.local.connections:
+            if scheme == 'https':
+                conn_class = httplib.HTTPSConnection
+            else:
+                conn_class = httplib.HTTPConnection
+            self.local.connections[key] = conn_class(netloc,
+                                                     timeout=self.timeout)
+        return self.local.connections[key]
+
+    def drop_connection(self, scheme, netloc):
+        """Closes and forgets this thread's connection to the given host."""
+
+        conn = self.local.connections.pop((scheme, netloc), None)
+        if conn:
+            conn.close()
+
+    def request(self, url, headers=None):
+        """Sends a GET request and returns the response.
+
+        Redirects are followed. A request on a reused connection that the
+        server has closed in the meantime is retried once on a new one.
+        """
+
+        for i in range(self.max_redirects + 1):
+            parts = urlparse.urlsplit(url)
+            path = urlparse.urlunsplit(('', '', parts.path or '/',
+                                        parts.query, ''))
+            for attempt in range(2):
+                conn = self.get_connection(parts.scheme, parts.netloc)
+                try:
+                    conn.request('GET', path, headers=headers or {})
+                    resp = conn.getresponse()
+                    break
+                except (httplib.HTTPException, socket.error):
+                    self.drop_connection(parts.scheme, parts.netloc)
+                    if attempt:
+                        raise
+            if resp.status not in (301, 302, 303, 307, 308):
+                resp.conn_key = (parts.scheme, parts.netloc)
+                return resp
+            resp.read()
+            url = urlparse.urljoin(url, resp.getheader('location', ''))
+        raise httplib.HTTPException('Too many redirects')
+
+    def open(self, user, chunk_size=16384):
+        """Starts retrieving the given user's contribution data.
+
+        If a cache is configured, fresh entries are returned without any
+        network access and stale ones are revalidated with a conditional
+        request.
+
+        Returns an iterator over chunks of the response or None if it could
+        not be fetched. The body is only read while iterating.
+        """
+
+        cached = None
+        headers = {'Accept-Encoding': 'gzip, deflate'}
+        if self.cache:
+            cached, meta = self.cache.get(user)
+            if cached is not None:
+                if self.cache.is_fresh(meta):
+                    return iter([cached])
+                if meta.get('etag'):
+                    headers['If-None-Match'] = meta['etag']
+                if meta.get('last_modified'):
+                    headers['If-Modified-Since'] = meta['last_modified']
+
+        url = self.get_url(user)
+        try:
+            resp = self.request(url, headers)
+            if resp.status != 200:
+                resp.read()
+        except (httplib.HTTPException, socket.error) as err:
+            print "There was a problem fetching data from {0}".format(url)
+            print err
+            return None
+        if resp.status == 304 and cached is not None:
+            self.cache.put(user, None, meta)
+            return iter([cached])
+        if resp.status != 200:
+            print "There was a problem fetching data from {0}".format(url)
+            print "HTTP Error {0}: {1}".format(resp.status, resp.reason)
+            return None
+        return self.iter_response(user, resp, chunk_size)
+
+    def count_bytes(self, wire_bytes, data_bytes):
+        """Adds to the transfer statistics."""
+
+        with self.lock:
+            self.wire_bytes += wire_bytes
+            self.data_bytes += data_bytes
+
+    def iter_response(self, user, resp, chunk_size):
+        """Yields the decoded body of a response in chunks and caches it."""
+
+        encoding = (resp.getheader('content-encoding') or '').strip().lower()
+        decompressor = None
+        if encoding in ('gzip', 'deflate'):
+            decompressor = Decompressor(encoding)
+        data_fo = self.cache.open_data(user) if self.cache else None
+        complete = False
+        try:
+            while True:
+                raw = resp.read(chunk_size)
+                if raw:
+                    chunk = decompressor.decompress(raw) if decompressor \
+                        else raw
+                elif decompressor:
+                    chunk = decompressor.flush()
+                    decompressor = None
+                else:
+                    break
+                self.count_bytes(len(raw), len(chunk))
+                if not chunk:
+                    continue
+                if data_fo:
+                    data_fo.write(chunk)
+                yield chunk
+            complete = True
+        finally:
+            if not complete:
+                self.drop_connection(*resp.conn_key)
+            if data_fo:
+                data_fo.close()
+                if complete:
+                    self.cache.put(user, None, {
+                        'etag': resp.getheader('etag'),
+                        'last_modified': resp.getheader('last-modified'),
+                    }, data_fo.name)
+                else:
+                    os.remove(data_fo.name)
+
+    def fetch(self, user):
+        """Retrieves the given user's contribution data.
+
+        Returns the lines of the response or None if it could not be fetched.
+        """
+
+        chunks = self.open(user)
+        if chunks is None:
+            return None
+        try:
+            data = ''.join(chunks)
+        except (httplib.HTTPException, socket.error, zlib.error) as err:
+            print "There was a problem fetching data from {0}".format(
+                self.get_url(user))
+            print err
+            return None
+        return data.splitlines(True)
+
+    def get_contributions(self, user):
+        """Retrieves and parses the given user's contribution data.
+
+        The calendar is parsed while it is being downloaded. Returns the
+        parsed data or None if it could not be fetched or is invalid.
+        """
+
+        chunks = self.open(user)
+        if chunks is None:
+            sys.stderr.write("Error: Unable to fetch calendar.\n")
+            return None
+        parser = CalendarParser()
+        try:
+            data = Calendar.from_days(parser.parse(chunks))
+        except (httplib.HTTPException, socket.error, zlib.error) as err:
+            print "There was a problem fetching data from {0}".format(
+                self.get_url(user))
+            print err
+            sys.stderr.write("Error: Unable to fetch calendar.\n")
+            return None
+        if not parser.valid:
+            sys.stderr.write(
+                "Error: That doesn't look like contribution data.\n"
+                "Check user name and try again.\n")
+            return None
+        return data
+
+    def fetch_many(self, users, jobs=8):
+        """Retrieves the contribution data of several users concurrently.
+
+        Returns a dictionary mapping user names to the result of
+        get_contributions().
+        """
+
+        users = list(set(users))
+        if not users:
+            return {}
+        pool = multiprocessing.pool.ThreadPool(min(jobs, len(users)))
+        try:
+            cals = pool.map(self.get_contributions, users)
+        finally:
+            pool.close()
+            pool.join()
+            self.evict_cache()
+        return dict(zip(users, cals))
+
+    def evict_cache(self):
+        """Removes old entries from the cache if there is one."""
+
+        if self.cache:
+            self.cache.evict()
+
+
+def get_calendar(user, fetcher=None):
     """Retrieves the given user's contribution data from Github."""
 
-    url = 'https://github.com/users/' + user + '/contributions'
-    try:
-        page = urllib2.urlopen(url)
-    except (urllib2.HTTPError, urllib2.URLError) as err:
-        print "There was a problem fetching data from {0}".format(url)
-        print err
+    if fetcher is None:
+        fetcher = CalendarFetcher()
+    return fetcher.fetch(user)
+
+
+def get_fetcher(conf):
+    """Returns a calendar fetcher configured according to conf."""
+
+    cache = None
+    if conf['cache_dir']:
+        cache = CalendarCache(conf['cache_dir'], conf['cache_ttl'],
+                              conf['cache_max_age'], conf['cache_max_size'])
+    return CalendarFetcher(conf['base_url'], conf['timeout'], cache)
+
+
+class CalendarParser(object):
+    """Incrementally extracts contribution data from a calendar page.
+
+    The page can be fed as raw bytes in chunks of any size. A single
+    precompiled expression finds both the calendar svg and every day of the
+    calendar, regardless of the order of the data attributes, so the page is
+    neither decoded nor split into lines and only scanned once. Every day is
+    returned as an (ordinal, count) tuple as soon as its tag is complete.
+    """
+
+    def __init__(self):
+        self.pending = ''
+        self.days = 0
+        self.svg = False
+
+    @property
+    def valid(self):
+        """Quick sanity check to see if the parsed page looks valid."""
+
+        return (self.svg and
+                calendar_min_days <= self.days <= calendar_max_days)
+
+    def extract(self, data, end):
+        """Returns the entries of all tags in data up to position end."""
+
+        ret = []
+        for svg, count, date, date_first, count_last in calendar_re.findall(
+                data, 0, end):
+            if svg:
+                self.svg = True
+                continue
+            if date_first:
+                count, date = count_last, date_first
+            ret.append((get_ordinal(date), int(count)))
+        self.days += len(ret)
+        return ret
+
+    def feed(self, chunk):
+        """Parses all tags completed by chunk and returns their entries."""
+
+        data = self.pending + chunk
+        end = max(data.rfind('>') + 1, len(data) - 4096)
+        self.pending = data[end:]
+        return self.extract(data, end)
+
+    def close(self):
+        """Parses any remaining data and returns its entries."""
+
+        data = self.pending
+        self.pending = ''
+        return self.extract(data, len(data))
+
+    def parse(self, chunks):
+        """Yields the entries of a page given as an iterable of chunks."""
+
+        for chunk in chunks:
+            for entry in self.feed(chunk):
+                yield entry
+        for entry in self.close():
+            yield entry
+
+
+class Calendar(object):
+    """Contribution counts of a contiguous range of days.
+
+    The counts are stored in an array indexed by the distance from the first
+    day, whose ordinal is kept in start. Dates are only derived when they are
+    needed. For compatibility, indexing a calendar returns a dictionary like
+    the ones parse_calendar() used to return, while slicing it returns a new
+    calendar.
+    """
+
+    def __init__(self, start=0, counts=()):
+        self.start = start
+        self.counts = array('i', counts)
+
+    @classmethod
+    def from_days(cls, days):
+        """Creates a calendar from an iterable of (ordinal, count) tuples.
+
+        Days missing in between are counted as zero.
+        """
+
+        days = list(days)
+        if not days:
+            return cls()
+        days.sort()
+        cal = cls(days[0][0])
+        cal.counts = array('i', [0]) * (days[-1][0] - days[0][0] + 1)
+        for ordinal, count in days:
+            cal.counts[ordinal - cal.start] = count
+        return cal
+
+    @classmethod
+    def from_entries(cls, entries):
+        """Creates a calendar from a list of dictionaries with date and count.
+
+        Negative counts are reported and replaced by zero.
+        """
+
+        days = []
+        for entry in entries:
+            count = entry['count']
+            if count < 0:
+                sys.stderr.write(
+                    "Warning: Found invalid value ({}) at {}.\n".format(
+                        count, entry['date']
+                    )
+                )
+                count = 0
+            days.append((get_ordinal(entry['date']), count))
+        return cls.from_days(days)
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __eq__(self, other):
+        return (isinstance(other, Calendar) and self.start == other.start and
+                self.counts == other.counts)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(len(self.counts))
+            if step != 1:
+                raise ValueError("Calendar slices must be contiguous")
+            return Calendar(self.start + start, self.counts[start:stop])
+        if idx < 0:
+            idx += len(self.counts)
+        return {'date': self.get_date(idx), 'count': self.counts[idx]}
+
+    def __iter__(self):
+        for idx in xrange(len(self.counts)):
+            yield {'date': self.get_date(idx), 'count': self.counts[idx]}
+
+    def get_date(self, idx):
+        """Returns the ISO date and time commits on day idx are created at."""
+
+        return date.fromordinal(self.start + idx).isoformat() + "T12:00:00"
+
+    def index(self, ordinal):
+        """Returns the position of the day with the given ordinal or None."""
+
+        idx = ordinal - self.start
+        if 0 <= idx < len(self.counts):
+            return idx
         return None
-    return page.readlines()
+
+    def weekday(self, idx):
+        """Returns the ISO weekday of day idx (1 = Monday, 7 = Sunday)."""
+
+        return (self.start + idx - 1) % 7 + 1
+
+
+def as_calendar(data):
+    """Returns data as a Calendar, converting lists of dictionaries."""
+
+    if isinstance(data, Calendar):
+        return data
+    return Calendar.from_entries(data)
 
 
 def calendar_valid(cal):
     """Quick santiy check to see if the fetched calendar looks valid."""
 
-    svg = 'js-calendar-graph-svg'
-    if len(cal) < 495:
-        return False
-    if any(svg in c for c in cal):
-        return True
-    return False
+    parser = CalendarParser()
+    parser.feed(''.join(cal))
+    parser.close()
+    return parser.valid
 
 
 def get_factor(data):
     """Calculates the factor by which the calender data has to be scaled."""
 
-    max_val = 0
-    for entry in data:
-        if entry['count'] < 0:
-            sys.stderr.write(
-                "Warning: Found invalid value ({}) at {}.\n".format(
-                    entry['count'], entry['date']
-                )
-            )
-            entry['count'] = 0
-        if entry['count'] > max_val:
-            max_val = entry['count']
+    counts = as_calendar(data).counts
+    max_val = max(counts) if counts else 0
 
     factor = max_val / 4.0
     if factor == 0:
@@ -246,34 +863,140 @@ def cal_scale(scale_factor, data_out):
         entry['count'] *= scale_factor
 
 
+def get_shade_counts(counts):
+    """Returns the smallest count that is displayed in each shade.
+
+    The shades are separated by the quartiles of the non-zero counts of the
+    calendar. The returned list is indexed by shade (0-4).
+    """
+
+    values = sorted(count for count in counts if count)
+    shade_counts = [0, 1]
+    if not values:
+        return shade_counts + [2, 3, 4]
+    for quartile in (1, 2, 3):
+        value = values[(len(values) - 1) * quartile // 4]
+        shade_counts.append(max(value, shade_counts[-1]) + 1)
+    return shade_counts
+
+
+def shade_scale(cal, data_out):
+    """Replaces the shades in data_out by the smallest number of commits
+    that makes the days appear in that shade on the calendar cal.
+
+    Since the planned days change the quartiles themselves, the thresholds
+    are recomputed from the smallest possible ones until they are stable,
+    which yields the lowest stable thresholds. Stable thresholds cannot
+    exceed the largest real count by more than 3; if they do, e.g. because
+    too many days ask for the darkest shade, or if more commits than with
+    cal_scale() would be needed, the days are scaled by cal_scale() instead.
+    Returns the number of commits planned and the number of commits
+    cal_scale() would have created.
+    """
+
+    factor = get_factor(cal)
+    scaled = sum(entry['count'] for entry in data_out) * factor
+    real = cal.counts
+    days = [(entry, cal.index(get_ordinal(entry['date'])), entry['count'])
+            for entry in data_out]
+    counts = array('i', real)
+    limit = max(max(real) if real else 0, 1) + 3
+    shade_counts = [0, 1, 2, 3, 4]
+    while shade_counts[4] <= limit:
+        for entry, idx, shade in days:
+            counts[idx] = max(real[idx], shade_counts[shade])
+        new_counts = get_shade_counts(counts)
+        if new_counts == shade_counts:
+            break
+        shade_counts = new_counts
+
+    planned = [max(0, shade_counts[shade] - real[idx]) if shade else 0
+               for entry, idx, shade in days]
+    if shade_counts[4] > limit or sum(planned) > scaled:
+        planned = [shade * factor for entry, idx, shade in days]
+    for (entry, idx, shade), count in zip(days, planned):
+        entry['count'] = count
+    return sum(planned), scaled
+
+
+def scale_dataset(cal, data_out, planner):
+    """Replaces the shades in data_out by numbers of commits.
+
+    planner is either 'scale' to multiply the shades by the factor of the
+    calendar cal or 'shade' to use shade_scale(). Returns the number of
+    commits planned and the number of commits cal_scale() would have
+    created.
+    """
+
+    if planner == 'shade':
+        return shade_scale(cal, data_out)
+    factor = get_factor(cal)
+    cal_scale(factor, data_out)
+    commits = sum(entry['count'] for entry in data_out)
+    return commits, commits
+
+
 def lang_valid(lang):
     if lang in known_languages:
         return True
     return False
 
+
+def backend_valid(backend):
+    if backend in known_backends:
+        return True
+    return False
+
+
+def planner_valid(planner):
+    if planner in known_planners:
+        return True
+    return False
+
+def read_timeframe_entries(frame):
+    """Returns the dates and date ranges given in a timeframe argument.
+
+    frame is either a comma separated list or '@FILE' or '-' to read the
+    list from FILE or stdin. Lists read from a file may also be separated
+    by whitespace and contain comments starting with '#'.
+    """
+
+    if frame == '-':
+        text = sys.stdin.read()
+    elif frame.startswith('@'):
+        with open(frame[1:]) as frame_fo:
+            text = frame_fo.read()
+    else:
+        return frame.split(',')
+
+    entries = []
+    for line in text.splitlines():
+        entries.extend(line.split('#', 1)[0].replace(',', ' ').split())
+    return entries
+
+
 def parse_timeframe_arg(frame, conf):
     intervals = []
     singledates = []
-    dates = frame.split(',')
+    try:
+        dates = read_timeframe_entries(frame)
+    except IOError as err:
+        print "Could not read dates: {}".format(err)
+        return False
+    if not dates:
+        print "No dates given: {}".format(frame)
+        return False
     for d in dates:
-        interval = d.split('-')
-        if interval[0] != d:
-            try:
-                intervals.append(
-                    [datetime.strptime(interval[0],"%Y%m%d") +
-                        timedelta(hours=12),
-                    datetime.strptime(interval[1],"%Y%m%d") +
-                        timedelta(hours=12)])
-            except ValueError:
-                print "Invalid value: {}".format(d)
-                return False
+        interval = parse_date_entry(d)
+        if interval is None:
+            print "Invalid value: {}".format(d)
+            return False
+        first, last = [datetime.fromordinal(ordinal) + timedelta(hours=12)
+                       for ordinal in interval]
+        if len(d) > 10:
+            intervals.append([first, last])
         else:
-            try:
-                singledates.append(datetime.strptime(d,"%Y%m%d") +
-                                   timedelta(hours=12))
-            except ValueError:
-                print "Invalid value: {}".format(d)
-                return False
+            singledates.append(first)
 
     conf['timeframe'] = {
         'intervals': intervals,
@@ -282,35 +1005,168 @@ def parse_timeframe_arg(frame, conf):
 
     return True
 
-def parse_args(argv):
-    """Parses the script's arguments via getopt."""
+def parse_date_entry(entry):
+    """Parses a date or date range in YYYYMMDD or YYYY-MM-DD format.
 
+    Ranges are separated by '-', '..' or '/'. Returns the ordinals of the
+    first and last day of the range or None if entry is invalid.
+    """
+
+    match = date_entry_re.match(entry)
+    if not match:
+        return None
+    fields = match.groups()
     try:
-        opts, args = getopt.getopt(
-            argv[1:], "fhknsvwd:l:m:p:r:u:", ["help", "version"])
+        first = date(int(fields[0]), int(fields[1]),
+                     int(fields[2])).toordinal()
+        if fields[3] is None:
+            return first, first
+        last = date(int(fields[3]), int(fields[4]),
+                    int(fields[5])).toordinal()
+    except ValueError:
+        return None
+    if last < first:
+        return None
+    return first, last
+
+
+def parse_holidays_arg(path, conf):
+    """Reads the dates on which no commits are created from a file.
+
+    Every line holds one date or date range; empty lines and lines
+    starting with '#' are ignored.
+    """
+
+    holidays = []
+    try:
+        with open(path) as holidays_fo:
+            for line in holidays_fo:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                interval = parse_date_entry(line)
+                if interval is None:
+                    print "Invalid value: {}".format(line)
+                    return False
+                holidays.append(interval)
+    except IOError as err:
+        print "Could not read holidays: {}".format(err)
+        return False
+
+    conf['holidays'] = holidays
+
+    return True
+
+
+def parse_args(argv, show_usage=True):
+    """Parses the script's arguments via getopt.
+
+    If show_usage is False, invalid arguments are reported without printing
+    the usage message.
+    """
+
+    long_opts = [
+        "help", "version", "batch=", "jobs=", "base-url=", "fetch-jobs=",
+        "timeout=", "cache-dir=", "cache-ttl=", "cache-max-age=",
+        "cache-max-size=", "holidays=", "planner=", "estimate",
+        "incremental", "seed-salt=", "push-chunk=", "bundle",
+        "compact-history", "variants=",
+    ]
+    try:
+        opts, args = getopt.getopt(argv[1:], "fhknsvwb:d:l:m:p:r:u:",
+                                   long_opts)
     except getopt.GetoptError as err:
         print str(err)
-        usage()
+        if show_usage:
+            usage()
         sys.exit(1)
 
     conf = {
+        'args': [],
+        'backend': 'script',
+        'base_url': 'https://github.com',
+        'batch': None,
+        'bundle': False,
+        'cache_dir': None,
+        'cache_max_age': 604800,
+        'cache_max_size': 104857600,
+        'cache_ttl': 3600,
+        'compact_history': False,
         'dryrun': False,
+        'estimate': False,
+        'fetch_jobs': 8,
         'force_data': False,
+        'holidays': [],
+        'incremental': False,
+        'jobs': 4,
         'keep': False,
         'lang': 'python',
         'max_shade': 4,
         'min_days': 5,
+        'planner': 'scale',
+        'push_chunk': 0,
         'repo': 'decoy',
+        'seed_salt': '',
         'ssh': False,
         'timeframe': {},
+        'timeout': 30,
         'user': os.getenv("USER"),
+        'variants': 0,
         'wdir': '/tmp',
         'workday': False,
     }
 
     for opt, arg in opts:
-        if opt == "-d":
-            conf['wdir'] = arg
+        if opt == "--batch":
+            conf['batch'] = arg
+            continue
+        elif opt == "--jobs":
+            conf['jobs'] = max(1, int(arg))
+            continue
+        elif opt[2:] + '=' in long_opts:
+            conf['args'].append(opt + '=' + arg)
+        else:
+            conf['args'].append(opt + arg)
+
+        if opt == "-b":
+            conf['backend'] = arg
+        elif opt == "--base-url":
+            conf['base_url'] = arg
+        elif opt == "--cache-dir":
+            conf['cache_dir'] = arg
+        elif opt == "--cache-ttl":
+            conf['cache_ttl'] = float(arg)
+        elif opt == "--cache-max-age":
+            conf['cache_max_age'] = float(arg)
+        elif opt == "--cache-max-size":
+            conf['cache_max_size'] = int(arg)
+        elif opt == "--holidays":
+            if not parse_holidays_arg(arg, conf):
+                sys.exit(1)
+        elif opt == "--variants":
+            val = int(arg)
+            if val > 1:
+                conf['variants'] = val
+        elif opt == "--compact-history":
+            conf['compact_history'] = True
+        elif opt == "--bundle":
+            conf['bundle'] = True
+        elif opt == "--push-chunk":
+            conf['push_chunk'] = max(0, int(arg))
+        elif opt == "--seed-salt":
+            conf['seed_salt'] = arg
+        elif opt == "--incremental":
+            conf['incremental'] = True
+        elif opt == "--estimate":
+            conf['estimate'] = True
+        elif opt == "--planner":
+            conf['planner'] = arg
+        elif opt == "--fetch-jobs":
+            conf['fetch_jobs'] = max(1, int(arg))
+        elif opt == "--timeout":
+            conf['timeout'] = float(arg)
+        elif opt == "-d":
+            conf['wdir'] = os.path.abspath(arg)
         elif opt in ("-h", "--help"):
             usage()
             sys.exit(0)
@@ -340,14 +1196,28 @@ def parse_args(argv):
             version()
             sys.exit(0)
 
-    if len(args) != 1:
-        usage()
+    if len(args) != (0 if conf['batch'] else 1):
+        if show_usage:
+            usage()
+        else:
+            print "Expected exactly one command"
         sys.exit(1)
 
     if not lang_valid(conf['lang']):
         print "Invalid language: {}".format(conf['lang'])
         sys.exit(1)
 
+    if not backend_valid(conf['backend']):
+        print "Invalid backend: {}".format(conf['backend'])
+        sys.exit(1)
+
+    if not planner_valid(conf['planner']):
+        print "Invalid planner: {}".format(conf['planner'])
+        sys.exit(1)
+
+    if conf['batch']:
+        return conf
+
     if args[0] in ("append", "fill"):
         conf['action'] = args[0]
     elif parse_timeframe_arg(args[0], conf) == True:
@@ -364,125 +1234,261 @@ def parse_args(argv):
 
 
 def parse_calendar(cal):
-    """Parse the raw svg data into a dictionary."""
+    """Parse the raw svg data into a Calendar."""
 
-    ret = []
-    for line in cal:
-        match = re.search(r'data-count="(\d+)".*data-date="(\d+-\d+-\d+)"',
-                          line)
-        if not match:
-            continue
-        ret.append({'date': match.group(2) + "T12:00:00",
-                    'count': int(match.group(1))})
-    return ret
+    parser = CalendarParser()
+    return Calendar.from_days(parser.feed(''.join(cal)) + parser.close())
+
+
+def get_ordinal(iso_date):
+    """Returns the proleptic Gregorian ordinal of an ISO date string."""
+
+    return date(int(iso_date[0:4]), int(iso_date[5:7]),
+                int(iso_date[8:10])).toordinal()
+
+
+def is_weekend(ordinal):
+    """Checks whether the day with the given ordinal is a Saturday or Sunday."""
 
+    return ordinal % 7 in (0, 6)
+
+
+def find_gaps(counts):
+    """Run-length encodes the days without contributions.
+
+    Returns a list of (start, length) tuples, one for every run of
+    consecutive days with a count of zero.
+    """
+
+    gaps = []
+    start = None
+    for idx, count in enumerate(counts):
+        if count:
+            if start is not None:
+                gaps.append((start, idx - start))
+                start = None
+        elif start is None:
+            start = idx
+    if start is not None:
+        gaps.append((start, len(counts) - start))
+    return gaps
+
+
+def select_gaps(gaps, action, min_days, days):
+    """Returns the gaps that are filled by the 'fill' or 'append' action.
+
+    'append' only considers the gap after the last contribution of a
+    calendar of the given number of days.
+    """
+
+    if action == 'append':
+        gaps = [gap for gap in gaps[-1:] if gap[0] + gap[1] == days]
+    return [gap for gap in gaps if gap[1] >= min_days]
+
+
+def clip_run(cal, first, last):
+    """Returns the run of calendar days between two ordinals.
+
+    The run is returned as a (start, length) tuple or None if it lies
+    completely outside of the calendar.
+    """
 
-def create_dataset(data_in, action, min_days, max_shade, force, timeframe, workday):
-    """Creates a data set representing the desired commits."""
+    start = max(first - cal.start, 0)
+    end = min(last - cal.start, len(cal) - 1)
+    if start > end:
+        return None
+    return start, end - start + 1
+
+
+def merge_intervals(intervals):
+    """Merges (first, last) ordinal tuples into a sorted list of disjoint
+    intervals. Overlapping and adjacent intervals are joined.
+    """
+
+    merged = []
+    for first, last in sorted(intervals):
+        if merged and first <= merged[-1][1] + 1:
+            if last > merged[-1][1]:
+                merged[-1] = (merged[-1][0], last)
+        else:
+            merged.append((first, last))
+    return merged
+
+
+def get_day_mask(cal, workday, holidays):
+    """Returns a bytearray holding 1 for every day of cal commits may be
+    created on and 0 for weekends (if workday is set) and holidays.
+    """
+
+    if workday:
+        mask = bytearray(0 if is_weekend(cal.start + idx) else 1
+                         for idx in xrange(len(cal)))
+    else:
+        mask = bytearray('\x01') * len(cal)
+    for first, last in holidays:
+        run = clip_run(cal, first, last)
+        if run:
+            mask[run[0]:run[0] + run[1]] = bytearray(run[1])
+    return mask
+
+
+def get_seed(user, repo, salt=''):
+    """Returns the seed of the random values planned for a repository."""
+
+    return hashlib.sha1('\0'.join([user, repo, salt])).hexdigest()
+
+
+def get_day_random(seed, ordinal):
+    """Returns a random number in [0, 1) that only depends on seed and the
+    ordinal of the day it is used for.
+    """
+
+    digest = hashlib.sha1('{0}:{1}'.format(seed, ordinal)).hexdigest()
+    return int(digest[:13], 16) / float(1 << 52)
+
+
+def create_dataset(data_in, action, min_days, max_shade, force, timeframe,
+                   workday, holidays=(), planner='scale', seed=None):
+    """Creates a data set representing the desired commits.
+
+    If seed is given, the shade of every day is derived from seed and the
+    day's date, so the same days are always planned with the same shades.
+    The shades are turned into numbers of commits by scale_dataset() using
+    planner; if planner is None, the shades are returned as they are.
+    """
 
     ret = []
-    idx_start = -1
-    idx_cur = 0
-    idx_max = len(data_in) - 1
-    if idx_max == -1:
+    data_in = as_calendar(data_in)
+    if not len(data_in):
         sys.stderr.write("Warning: Empty input; not creating dataset\n")
         return ret
-    random.seed()
+    if seed is None:
+        random.seed()
+        rand = lambda idx: random.random()
+    else:
+        rand = lambda idx: get_day_random(seed, data_in.start + idx)
+    shades = max_shade + 1
+
+    mask = get_day_mask(data_in, workday and not force, holidays)
 
     if force:
-        for i in range(0, idx_max):
-            ret.append({'date': data_in[i]['date'],
-                                'count': random.randint(0, max_shade)})
+        days = compress(xrange(len(data_in)), mask)
     elif action == 'timeframe':
+        intervals = [(in_interval[0].toordinal(), in_interval[1].toordinal())
+                     for in_interval in timeframe['intervals']]
+        # Explicitly requested single dates may be on weekends but not on
+        # holidays.
+        free = get_day_mask(data_in, False, holidays)
         for in_date in timeframe['singledates']:
-            in_iso = format(in_date.isoformat())
-            for cal_date in data_in:
-                if cal_date['date'] == in_iso:
-                    ret.append({'date': cal_date['date'],
-                        'count': random.randint(0, max_shade)})
-
-        for in_interval in timeframe['intervals']:
-            diff_days = (in_interval[1] - in_interval[0]).days
-            while diff_days >= 0:
-                in_iso = (in_interval[0] + timedelta(days=diff_days)).isoformat()
-
-                for cal_date in data_in:
-                    if cal_date['date'] == in_iso:
-                        if workday and (datetime.strptime(in_iso, "%Y-%m-%dT%H:%M:%S").isoweekday() == 6 or datetime.strptime(in_iso, "%Y-%m-%dT%H:%M:%S").isoweekday() == 7):
-                            continue
-                        ret.append({'date': cal_date['date'],
-                            'count': random.randint(0, max_shade)})
-
-                diff_days -= 1
+            ordinal = in_date.toordinal()
+            idx = data_in.index(ordinal)
+            if idx is not None:
+                mask[idx] = free[idx]
+                intervals.append((ordinal, ordinal))
+        days = []
+        for first, last in merge_intervals(intervals):
+            run = clip_run(data_in, first, last)
+            if run:
+                days.extend(compress(xrange(run[0], run[0] + run[1]),
+                                     mask[run[0]:run[0] + run[1]]))
     else:
-        if action == 'append':
-            idx_cur = idx_max
-            for entry in reversed(data_in):
-                if entry['count']:
-                    break
-                idx_cur -= 1
-
-        # NOTE: This won't fill the last day if it is not preceded by at least one
-        # other empty day. Doesn't matter though, as we're only filling blocks of
-        # at least three continuous empty days.
-        for entry in data_in[idx_cur:]:
-            if entry['count'] or idx_cur == idx_max:
-                if idx_start > -1:
-                    idx_range = range(idx_start,
-                                      idx_cur if entry['count'] else idx_cur + 1)
-                    idx_start = -1
-                    if len(idx_range) < min_days:
-                        idx_cur += 1
-                        continue
-                    for i in idx_range:
-                        # TODO: maybe add something like this to be able to only
-                        #       fill working days ?
-                        # if datetime.strptime(
-                        #        data_in[i]['date'],
-                        #        "%Y-%m-%dT%H:%M:%S").isoweekday() != 6
-                        #    and datetime.strptime(
-                        #            data_in[i]['date'],
-                        #            "%Y-%m-%dT%H:%M:%S").isoweekday() != 7:
-                        if workday and (datetime.strptime( data_in[i]['date'], "%Y-%m-%dT%H:%M:%S").isoweekday() == 6 or datetime.strptime( data_in[i]['date'], "%Y-%m-%dT%H:%M:%S").isoweekday() == 7):
-                            continue
-                        ret.append({'date': data_in[i]['date'],
-                                    'count': random.randint(0, max_shade)})
-            elif idx_start == -1:
-                idx_start = idx_cur
-            idx_cur += 1
-
-    cal_scale(get_factor(data_in), ret)
+        gaps = select_gaps(find_gaps(data_in.counts), action, min_days,
+                           len(data_in))
+        days = [idx for start, length in gaps
+                for idx in compress(xrange(start, start + length),
+                                    mask[start:start + length])]
+
+    for idx in days:
+        ret.append({'date': data_in.get_date(idx),
+                    'count': int(rand(idx) * shades)})
+
+    if planner:
+        scale_dataset(data_in, ret, planner)
     return ret
 
 
 def get_content_template(lang):
-    git_cmd = '\nGIT_AUTHOR_DATE={0} GIT_COMMITTER_DATE={0} git commit -a -m "ghdecoy" > /dev/null\n'
+    git_cmd = '\nGIT_AUTHOR_DATE={0} GIT_COMMITTER_DATE={0} git commit -a --allow-empty -m "ghdecoy" > /dev/null\n'
 
     return content_templates[lang]['data'] + git_cmd
 
 
-def create_script(conf, data_out, template):
+def get_compact_commits(lang, data_out, start=0, variants=0):
+    """Returns the commit section of the script for the compact backend.
+
+    Instead of repeating the content template for every commit, the file is
+    written by a shell function that is called for every line of a table of
+    dates and commit counts.
+    """
+
+    if variants:
+        start %= variants
+        increment = 'J=$(((J + 1) % {0}))'.format(variants)
+    else:
+        increment = 'J=$((J + 1))'
+
+    marker = '@GHDECOY_J@'
+    lines = render_content(lang, marker).split('\n')[:-1]
+    printf = ' \\\n        '.join(
+        ["printf '%s\\n'"] +
+        ["'" + l.replace("'", "'\\''").replace(marker, "'\"$J\"'") + "'"
+         for l in lines])
+    table = ''.join(['{0} {1}\n'.format(entry['date'], entry['count'])
+                     for entry in data_out if entry['count'] > 0])
+
+    return (
+        'decoy_commit() {{\n'
+        '    {0} > decoy{1}\n'
+        '    GIT_AUTHOR_DATE=$1 GIT_COMMITTER_DATE=$1 git commit -a --allow-empty -m "ghdecoy" > /dev/null\n'
+        '    {4}\n'
+        '}}\n'
+        'J={3}\n'
+        'while read DATE COUNT; do\n'
+        '    while [ $COUNT -gt 0 ]; do\n'
+        '        decoy_commit $DATE\n'
+        '        COUNT=$((COUNT - 1))\n'
+        '    done\n'
+        'done <<EOF\n'
+        '{2}'
+        'EOF\n'
+    ).format(printf, content_templates[lang]['ext'], table, start, increment)
+
+
+def create_script(conf, data_out, template, start=0):
     """Creates a bash script that executes the actual git operations.
 
     The bash script created by this function creates a git repository, fills
     it with commits as specified via it's arguments and pushes it to github.
+
+    The commits are written to the script one by one as they are generated,
+    so memory usage does not depend on the number of commits. start is the
+    number of commits already in the repository.
     """
 
-    content_template = get_content_template(conf['lang'])
-    fake_commits = []
-    j = 0
-    for entry in data_out:
-        for i in range(entry['count']):
-            fake_commits.append(
-                content_template.format(entry['date'], j))
-            j += 1
     script_name = ''.join([conf['wdir'], '/ghdecoy.sh'])
     script_fo = open(script_name, "w")
-    script_fo.write(
-        template.format(conf['repo'], content_templates[conf['lang']]['ext'], ''.join(fake_commits) ,conf['user']))
+    write_script(conf, data_out, template, script_fo, start)
     script_fo.close()
 
 
+def write_script(conf, data_out, template, script_fo, start=0):
+    """Writes the bash script for the data set to a file object."""
+
+    args = (conf['repo'], content_templates[conf['lang']]['ext'], '',
+            conf['user'])
+    header, footer = template.split('{2}', 1)
+    script_fo.write(header.format(*args))
+    if conf.get('backend') == 'compact':
+        script_fo.write(get_compact_commits(conf['lang'], data_out, start,
+                                            conf.get('variants', 0)))
+    else:
+        content_template = get_content_template(conf['lang'])
+        for date, j in iter_commits(data_out, start,
+                                    conf.get('variants', 0)):
+            script_fo.write(content_template.format(date, j))
+    script_fo.write(footer.format(*args))
+
+
 def create_template(conf):
     """ Creates a template format string for the repo creation script."""
     template = (
@@ -497,57 +1503,1022 @@ def create_template(conf):
     )
 
     if conf['ssh']:
+        url = 'git@github.com:{3}/$REPO.git'
+    else:
+        url = 'https://github.com/{3}/$REPO.git'
+
+    if conf.get('incremental'):
         template = ''.join([template,
-                            'git remote add origin git@github.com:{3}/$REPO.git\n'])
+                            'git remote add origin {0} 2> /dev/null || '
+                            'git remote set-url origin {0}\n'.format(url)])
     else:
         template = ''.join([template,
-                            'git remote add origin https://github.com/{3}/$REPO.git\n'])
-
-    template = ''.join([template, 'set +e\ngit pull\nset -e\n'])
+                            'git remote add origin {0}\n'.format(url)])
+    if conf.get('incremental') and not conf.get('compact_history'):
+        push = 'git push -u origin master\n'
+    else:
+        push = ('git push --force-with-lease=master:'
+                '$(git ls-remote origin refs/heads/master | cut -f1) '
+                '-u origin master\n')
 
-    if not conf['dryrun']:
-        template = ''.join([template, 'git push -f -u origin master\n'])
+    if not (conf['dryrun'] or conf.get('push_chunk') or conf.get('bundle')):
+        template = ''.join([template, push])
 
     return template
 
 
-def main():
-    """The scripts main function."""
+def render_content(lang, j):
+    """Returns the file contents the template for LANG writes for commit j.
 
-    conf = parse_args(sys.argv)
-    ret = 0
+    This evaluates the echo commands of the template instead of running
+    them in a shell so that backends which do not use the bash script
+    produce exactly the same files.
+    """
 
-    cal = get_calendar(conf['user'])
-    if not cal:
-        sys.stderr.write("Error: Unable to fetch calendar.\n")
-        sys.exit(1)
-    if not calendar_valid(cal):
-        sys.stderr.write("Error: That doesn't look like contribution data.\n"
-                         "Check user name and try again.\n")
-        sys.exit(1)
+    lines = []
+    for line in content_templates[lang]['data'].format('', j).split('\n'):
+        match = echo_re.match(line)
+        if not match:
+            continue
+        if match.group(1) is not None:
+            lines.append(match.group(1))
+        else:
+            lines.append(match.group(2))
+    return ''.join([l + '\n' for l in lines])
+
+
+def iter_commits(data_out, start=0, variants=0):
+    """Yields date and content number of every commit in the data set.
+
+    The content numbers start at start. If variants is given, they cycle
+    through 0 to variants - 1 so only that many different contents are
+    created, while consecutive commits still differ.
+    """
+
+    j = start
+    for entry in data_out:
+        for i in xrange(entry['count']):
+            yield entry['date'], (j % variants if variants else j)
+            j += 1
+
+
+def get_git_date(date):
+    """Converts an ISO date in local time to git's raw date format."""
+
+    stamp = time.mktime(time.strptime(date, "%Y-%m-%dT%H:%M:%S"))
+    if time.localtime(stamp).tm_isdst > 0:
+        offset = -time.altzone
+    else:
+        offset = -time.timezone
+    sign = '+' if offset >= 0 else '-'
+    offset = abs(offset) / 60
+    return "{0} {1}{2:02d}{3:02d}".format(int(stamp), sign,
+                                         offset / 60, offset % 60)
+
+
+def get_git_ident(repo, var='GIT_AUTHOR_IDENT'):
+    """Returns the 'Name <email>' part of git's identity for commits."""
+
+    ident = subprocess.check_output(['git', 'var', var], cwd=repo)
+    return ident.strip().rsplit(' ', 2)[0]
+
+
+def get_remote_url(conf):
+    """Returns the URL of the github repository to push to."""
+
+    if conf['ssh']:
+        return 'git@github.com:{0}/{1}.git'.format(conf['user'], conf['repo'])
+    return 'https://github.com/{0}/{1}.git'.format(conf['user'], conf['repo'])
+
+
+def write_fast_import(conf, data_out, author, committer, stream,
+                      parent=None, start=0):
+    """Writes the commits of the data set as a git fast-import stream.
+
+    If parent is given, the first commit is created on top of it.
+    """
+
+    path = 'decoy' + content_templates[conf['lang']]['ext']
+    for date, j in iter_commits(data_out, start, conf.get('variants', 0)):
+        git_date = get_git_date(date)
+        content = render_content(conf['lang'], j)
+        stream.write(
+            'commit refs/heads/master\n'
+            'author {0} {2}\n'
+            'committer {1} {2}\n'
+            'data 8\nghdecoy\n'.format(author, committer, git_date))
+        if parent:
+            stream.write('from {0}\n'.format(parent))
+            parent = None
+        stream.write(
+            'M 100644 inline {0}\n'
+            'data {1}\n{2}\n'.format(path, len(content), content))
+
+
+def build_fast_import(conf, data_out, parent=None, start=0):
+    """Creates the repository by piping all commits into git fast-import.
+
+    Unlike the bash script this only starts a handful of git processes no
+    matter how many commits are created.
+    """
+
+    repo = os.path.join(conf['wdir'], conf['repo'])
+    subprocess.check_call(['git', 'init', '-q', repo])
+    if next(iter_commits(data_out, start, conf.get('variants', 0)),
+            None) is None:
+        return
+    author = get_git_ident(repo)
+    committer = get_git_ident(repo, 'GIT_COMMITTER_IDENT')
+    proc = subprocess.Popen(['git', 'fast-import', '--quiet'],
+                            stdin=subprocess.PIPE, cwd=repo)
+    try:
+        write_fast_import(conf, data_out, author, committer, proc.stdin,
+                          parent, start)
+    finally:
+        proc.stdin.close()
+    if proc.wait():
+        raise subprocess.CalledProcessError(proc.returncode, 'git fast-import')
+    subprocess.check_call(['git', 'checkout', '-q', '-f', 'master'], cwd=repo)
 
-    data_out = create_dataset(parse_calendar(cal), conf['action'],
+
+class PackWriter(object):
+    """Writes git objects into a single version 2 packfile and its index.
+
+    Objects are stored undeltified and each object is only written once, no
+    matter how often it is added.
+    """
+
+    def __init__(self, pack_dir):
+        self.pack_dir = pack_dir
+        self.tmp_name = os.path.join(pack_dir, 'tmp_pack_ghdecoy')
+        self.pack_fo = open(self.tmp_name, 'w+b')
+        self.pack_fo.write('PACK' + struct.pack('>II', 2, 0))
+        self.entries = {}
+
+    def add(self, obj_type, data):
+        """Adds an object to the pack and returns its binary SHA-1."""
+
+        sha = hashlib.sha1('{0} {1}\0'.format(obj_type, len(data)))
+        sha.update(data)
+        sha = sha.digest()
+        if sha in self.entries:
+            return sha
+
+        size = len(data)
+        header = [(pack_types[obj_type] << 4) | (size & 0x0f)]
+        size >>= 4
+        while size:
+            header[-1] |= 0x80
+            header.append(size & 0x7f)
+            size >>= 7
+        chunk = ''.join(chr(c) for c in header) + zlib.compress(data)
+        self.entries[sha] = (self.pack_fo.tell(),
+                             zlib.crc32(chunk) & 0xffffffff)
+        self.pack_fo.write(chunk)
+        return sha
+
+    def close(self):
+        """Finalizes the packfile, writes its index and returns its name."""
+
+        self.pack_fo.seek(8)
+        self.pack_fo.write(struct.pack('>I', len(self.entries)))
+        self.pack_fo.seek(0)
+        pack_sha = hashlib.sha1()
+        for chunk in iter(lambda: self.pack_fo.read(65536), ''):
+            pack_sha.update(chunk)
+        pack_sha = pack_sha.digest()
+        self.pack_fo.write(pack_sha)
+        self.pack_fo.close()
+
+        shas = sorted(self.entries)
+        fanout = [0] * 256
+        for sha in shas:
+            fanout[ord(sha[0])] += 1
+        for i in range(1, 256):
+            fanout[i] += fanout[i - 1]
+        offsets = []
+        large_offsets = []
+        for sha in shas:
+            offset = self.entries[sha][0]
+            if offset < 0x80000000:
+                offsets.append(offset)
+            else:
+                offsets.append(0x80000000 | len(large_offsets))
+                large_offsets.append(offset)
+        idx = ''.join([
+            '\377tOc',
+            struct.pack('>I', 2),
+            struct.pack('>256I', *fanout),
+            ''.join(shas),
+            ''.join(struct.pack('>I', self.entries[sha][1]) for sha in shas),
+            ''.join(struct.pack('>I', offset) for offset in offsets),
+            ''.join(struct.pack('>Q', offset) for offset in large_offsets),
+            pack_sha,
+        ])
+        idx += hashlib.sha1(idx).digest()
+
+        name = os.path.join(self.pack_dir,
+                            'pack-' + binascii.hexlify(pack_sha))
+        with open(name + '.idx', 'wb') as idx_fo:
+            idx_fo.write(idx)
+        os.rename(self.tmp_name, name + '.pack')
+        return name
+
+
+def init_repo(repo):
+    """Creates an empty git repository without running git init."""
+
+    git_dir = os.path.join(repo, '.git')
+    for sub_dir in ('objects/pack', 'objects/info', 'refs/heads',
+                    'refs/tags'):
+        os.makedirs(os.path.join(git_dir, sub_dir))
+    with open(os.path.join(git_dir, 'HEAD'), 'w') as head:
+        head.write('ref: refs/heads/master\n')
+    with open(os.path.join(git_dir, 'config'), 'w') as config:
+        config.write('[core]\n'
+                     '\trepositoryformatversion = 0\n'
+                     '\tfilemode = true\n'
+                     '\tbare = false\n'
+                     '\tlogallrefupdates = true\n')
+
+
+def write_index(repo, path, sha):
+    """Writes a git index containing the single file PATH."""
+
+    stat = os.stat(os.path.join(repo, path))
+    entry = struct.pack(
+        '>10I', int(stat.st_ctime) & 0xffffffff, 0,
+        int(stat.st_mtime) & 0xffffffff, 0, stat.st_dev & 0xffffffff,
+        stat.st_ino & 0xffffffff, 0100644, stat.st_uid, stat.st_gid,
+        stat.st_size & 0xffffffff) + sha + struct.pack('>H', len(path)) + path
+    entry += '\0' * (8 - len(entry) % 8)
+    index = 'DIRC' + struct.pack('>II', 2, 1) + entry
+    index += hashlib.sha1(index).digest()
+    with open(os.path.join(repo, '.git', 'index'), 'wb') as index_fo:
+        index_fo.write(index)
+
+
+def get_commit_object(tree, parent, author, committer, date):
+    """Returns the raw contents of a commit object."""
+
+    lines = ['tree ' + binascii.hexlify(tree)]
+    if parent:
+        lines.append('parent ' + binascii.hexlify(parent))
+    git_date = get_git_date(date)
+    lines.append('author {0} {1}'.format(author, git_date))
+    lines.append('committer {0} {1}'.format(committer, git_date))
+    lines.append('\nghdecoy\n')
+    return '\n'.join(lines)
+
+
+def write_history(conf, data_out, writer, author, committer, parent=None,
+                  start=0):
+    """Adds the objects of all commits in the data set to an object writer.
+
+    The first commit is created on top of the hex SHA-1 parent if given.
+    Returns the binary SHA-1s of the last commit and blob together with the
+    contents of the last blob.
+    """
+
+    path = 'decoy' + content_templates[conf['lang']]['ext']
+    head = binascii.unhexlify(parent) if parent else None
+    blob = None
+    content = ''
+    for date, j in iter_commits(data_out, start, conf.get('variants', 0)):
+        content = render_content(conf['lang'], j)
+        blob = writer.add('blob', content)
+        tree = writer.add('tree', '100644 {0}\0'.format(path) + blob)
+        head = writer.add('commit', get_commit_object(tree, head, author,
+                                                      committer, date))
+    return head, blob, content
+
+
+def build_pack(conf, data_out, parent=None, start=0):
+    """Creates the repository by writing a packfile directly.
+
+    All objects are computed in python; git is only used to look up the
+    commit identity and, later on, to push the repository.
+    """
+
+    repo = os.path.join(conf['wdir'], conf['repo'])
+    if not os.path.isdir(os.path.join(repo, '.git')):
+        init_repo(repo)
+    author = get_git_ident(repo)
+    committer = get_git_ident(repo, 'GIT_COMMITTER_IDENT')
+    path = 'decoy' + content_templates[conf['lang']]['ext']
+    writer = PackWriter(os.path.join(repo, '.git', 'objects', 'pack'))
+    head, blob, content = write_history(conf, data_out, writer, author,
+                                        committer, parent, start)
+    writer.close()
+    if not blob:
+        return
+
+    with open(os.path.join(repo, '.git', 'refs', 'heads', 'master'),
+              'w') as ref:
+        ref.write(binascii.hexlify(head) + '\n')
+    with open(os.path.join(repo, path), 'w') as decoy:
+        decoy.write(content)
+    write_index(repo, path, blob)
+
+
+class PlumbingWriter(object):
+    """Writes git objects through long running git hash-object processes.
+
+    One 'git hash-object --stdin-paths' process is kept open per object type;
+    every object is handed to it through the same scratch file so no process
+    is started per commit and no working tree or index is touched.
+    """
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.scratch = os.path.join(repo, '.git', 'GHDECOY_OBJECT')
+        self.procs = {}
+
+    def add(self, obj_type, data):
+        """Writes an object to the repository and returns its binary SHA-1."""
+
+        if obj_type not in self.procs:
+            self.procs[obj_type] = subprocess.Popen(
+                ['git', 'hash-object', '-w', '--no-filters', '--stdin-paths',
+                 '-t', obj_type],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=self.repo)
+        proc = self.procs[obj_type]
+        with open(self.scratch, 'wb') as scratch:
+            scratch.write(data)
+        proc.stdin.write(self.scratch + '\n')
+        proc.stdin.flush()
+        sha = proc.stdout.readline().strip()
+        if len(sha) != 40:
+            raise subprocess.CalledProcessError(proc.wait(),
+                                                'git hash-object')
+        return binascii.unhexlify(sha)
+
+    def close(self):
+        """Stops all git processes and removes the scratch file."""
+
+        ret = 0
+        for proc in self.procs.values():
+            proc.stdin.close()
+            ret = proc.wait() or ret
+        self.procs = {}
+        if os.path.exists(self.scratch):
+            os.remove(self.scratch)
+        if ret:
+            raise subprocess.CalledProcessError(ret, 'git hash-object')
+
+
+def build_plumbing(conf, data_out, parent=None, start=0):
+    """Creates the repository using git plumbing commands.
+
+    Blobs, trees and commits are written by persistent git processes, so
+    neither a shell nor a git commit is run per fake commit.
+    """
+
+    repo = os.path.join(conf['wdir'], conf['repo'])
+    subprocess.check_call(['git', 'init', '-q', repo])
+    author = get_git_ident(repo)
+    committer = get_git_ident(repo, 'GIT_COMMITTER_IDENT')
+    writer = PlumbingWriter(repo)
+    try:
+        head, blob = write_history(conf, data_out, writer, author,
+                                   committer, parent, start)[:2]
+    finally:
+        writer.close()
+    if not blob:
+        return
+
+    subprocess.check_call(['git', 'update-ref', 'refs/heads/master',
+                           binascii.hexlify(head)], cwd=repo)
+    subprocess.check_call(['git', 'checkout', '-q', '-f', 'master'], cwd=repo)
+
+
+def publish_repo(conf):
+    """Adds the github remote to the repository and pushes it.
+
+    This is what the bash script does after creating the commits; it is used
+    by all other backends.
+    """
+
+    repo = os.path.join(conf['wdir'], conf['repo'])
+    if conf.get('incremental'):
+        set_remote(conf, repo)
+    else:
+        subprocess.check_call(['git', 'remote', 'add', 'origin',
+                               get_remote_url(conf)], cwd=repo)
+    if conf['dryrun']:
+        return
+    if conf.get('push_chunk'):
+        push_chunks(conf, repo)
+        return
+    if conf.get('incremental') and not conf.get('compact_history'):
+        push = ['git', 'push', '-u', 'origin', 'master']
+    else:
+        push = ['git', 'push', '--force-with-lease=master:{0}'.format(
+            get_remote_head(repo) or ''), '-u', 'origin', 'master']
+    subprocess.check_call(push, cwd=repo)
+
+
+def read_object(reader, sha):
+    """Reads the raw contents of an object from a 'git cat-file --batch'
+    process.
+    """
+
+    reader.stdin.write(sha + '\n')
+    reader.stdin.flush()
+    header = reader.stdout.readline().split()
+    if len(header) != 3:
+        raise subprocess.CalledProcessError(1, 'git cat-file ' + sha)
+    data = reader.stdout.read(int(header[2]))
+    reader.stdout.read(1)
+    return data
+
+
+def compact_history(repo, first):
+    """Removes all commits of days before the ordinal first from master.
+
+    The commits before the first removed one are kept as they are; the
+    later ones that are kept are recreated on top of them, reusing their
+    trees, authors and messages. If no commit is kept, master is deleted
+    so the next commits start a new history. Returns the number of
+    removed commits.
+    """
+
+    if not os.path.isdir(os.path.join(repo, '.git')):
+        return 0
+    try:
+        with open(os.devnull, 'w') as devnull:
+            log = subprocess.check_output(
+                ['git', 'log', '--reverse', '--first-parent',
+                 '--format=%H %at', 'refs/heads/master', '--'],
+                cwd=repo, stderr=devnull).split()
+    except subprocess.CalledProcessError:
+        return 0
+    commits = [(sha, date.fromtimestamp(int(stamp)).toordinal() >= first)
+               for sha, stamp in zip(log[0::2], log[1::2])]
+    if all(keep for sha, keep in commits):
+        return 0
+    if not any(keep for sha, keep in commits):
+        subprocess.check_call(['git', 'update-ref', '-d', 'refs/heads/master'],
+                              cwd=repo)
+        return len(commits)
+
+    idx = [keep for sha, keep in commits].index(False)
+    parent = commits[idx - 1][0] if idx else None
+    removed = 0
+    reader = subprocess.Popen(['git', 'cat-file', '--batch'],
+                              stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                              cwd=repo)
+    writer = PlumbingWriter(repo)
+    try:
+        for sha, keep in commits[idx:]:
+            if not keep:
+                removed += 1
+                continue
+            tree, body = read_object(reader, sha).split('\n', 1)
+            while body.startswith('parent '):
+                body = body.split('\n', 1)[1]
+            if parent:
+                body = 'parent {0}\n{1}'.format(parent, body)
+            parent = binascii.hexlify(writer.add('commit',
+                                                 tree + '\n' + body))
+    finally:
+        writer.close()
+        reader.stdin.close()
+        reader.wait()
+
+    subprocess.check_call(['git', 'update-ref', 'refs/heads/master', parent],
+                          cwd=repo)
+    return removed
+
+
+def create_bundle(conf, repo, parent=None):
+    """Writes the master branch of repo to a git bundle in conf['wdir'].
+
+    If parent is given, the bundle only contains the commits after it.
+    Returns the path of the bundle.
+    """
+
+    path = os.path.join(os.path.abspath(conf['wdir']),
+                        conf['repo'] + '.bundle')
+    revs = ['master']
+    if parent:
+        revs.append('^' + parent)
+    subprocess.check_call(['git', 'bundle', 'create', '-q', path] + revs,
+                          cwd=repo)
+    return path
+
+
+def get_checkpoint_path(repo):
+    """Returns the path of the file recording the progress of a push."""
+
+    return os.path.join(repo, '.git', 'ghdecoy-push')
+
+
+def write_checkpoint(path, sha):
+    """Atomically records sha as the last commit known to be pushed."""
+
+    with open(path + '.tmp', 'w') as checkpoint_fo:
+        checkpoint_fo.write(sha + '\n')
+    os.rename(path + '.tmp', path)
+
+
+def push_chunks(conf, repo):
+    """Pushes the master branch in chunks of conf['push_chunk'] commits.
+
+    After every chunk the pushed commit is recorded in a checkpoint file,
+    so an interrupted push can be resumed by calling this function again.
+    The first checkpoint holds the remote head before the push; without
+    --incremental it is used to overwrite the remote branch with
+    --force-with-lease. The checkpoint is removed once everything is pushed.
+    Returns the number of commits pushed.
+    """
+
+    checkpoint = get_checkpoint_path(repo)
+    if os.path.exists(checkpoint):
+        with open(checkpoint) as checkpoint_fo:
+            base = checkpoint_fo.read().strip()
+    else:
+        base = get_remote_head(repo) or ''
+        write_checkpoint(checkpoint, base)
+
+    rev_list = ['git', 'rev-list', '--reverse', '--first-parent',
+                'refs/heads/master']
+    with open(os.devnull, 'w') as devnull:
+        if base and not subprocess.call(['git', 'cat-file', '-e',
+                                         base + '^{commit}'], cwd=repo,
+                                        stderr=devnull):
+            rev_list.append('^' + base)
+    revs = subprocess.check_output(rev_list, cwd=repo).split()
+
+    chunk = conf['push_chunk']
+    for pushed in range(chunk, len(revs) + chunk, chunk):
+        pushed = min(pushed, len(revs))
+        sha = revs[pushed - 1]
+        push = ['git', 'push', '-q']
+        if not conf.get('incremental') or conf.get('compact_history'):
+            push.append('--force-with-lease=refs/heads/master:' + base)
+        subprocess.check_call(push + ['origin', sha + ':refs/heads/master'],
+                              cwd=repo)
+        write_checkpoint(checkpoint, sha)
+        base = sha
+        print "Pushed {0}/{1} commits".format(pushed, len(revs))
+
+    for key, value in (('remote', 'origin'), ('merge', 'refs/heads/master')):
+        subprocess.check_call(['git', 'config', 'branch.master.' + key,
+                               value], cwd=repo)
+    os.remove(checkpoint)
+    return len(revs)
+
+
+def set_remote(conf, repo):
+    """Points the remote 'origin' of repo to the github repository."""
+
+    with open(os.devnull, 'w') as devnull:
+        missing = subprocess.call(['git', 'remote', 'set-url', 'origin',
+                                   get_remote_url(conf)], cwd=repo,
+                                  stderr=devnull)
+    if missing:
+        subprocess.check_call(['git', 'remote', 'add', 'origin',
+                               get_remote_url(conf)], cwd=repo)
+
+
+def get_remote_head(repo):
+    """Returns the hex SHA-1 of the master branch of the remote 'origin'.
+
+    Only the ref is transferred. Returns None if the branch or the remote
+    repository does not exist.
+    """
+
+    try:
+        refs = subprocess.check_output(
+            ['git', 'ls-remote', 'origin', 'refs/heads/master'], cwd=repo)
+    except subprocess.CalledProcessError:
+        return None
+    return refs.split()[0] if refs else None
+
+
+def sync_repo(conf):
+    """Updates the master branch of a persistent repository from github.
+
+    If the remote branch is not known locally, its commits and trees are
+    fetched without any blobs and master is moved to it if that is a
+    fast-forward. Nothing is fetched if the repository is up to date.
+    Returns the head of the remote branch or None if it does not exist.
+    """
+
+    repo = os.path.join(conf['wdir'], conf['repo'])
+    if not os.path.isdir(os.path.join(repo, '.git')):
+        subprocess.check_call(['git', 'init', '-q', repo])
+    set_remote(conf, repo)
+    remote = get_remote_head(repo)
+    if not remote:
+        return None
+    with open(os.devnull, 'w') as devnull:
+        if not subprocess.call(['git', 'cat-file', '-e', remote + '^{commit}'],
+                               cwd=repo, stderr=devnull):
+            return remote
+        subprocess.check_call(['git', 'fetch', '-q', '--filter=blob:none',
+                               'origin', 'master'], cwd=repo)
+        local = get_repo_history(repo)[0]
+        if local and subprocess.call(['git', 'merge-base', '--is-ancestor',
+                                      local, remote], cwd=repo,
+                                     stderr=devnull):
+            return remote
+    subprocess.check_call(['git', 'update-ref', 'refs/heads/master', remote],
+                          cwd=repo)
+    subprocess.check_call(['git', 'read-tree', 'refs/heads/master'], cwd=repo)
+    return remote
+
+
+def get_repo_history(repo):
+    """Returns the head, number of commits and days covered by the master
+    branch of an existing decoy repository.
+
+    The head is None and no days are covered if the repository or branch
+    does not exist yet.
+    """
+
+    if not os.path.isdir(os.path.join(repo, '.git')):
+        return None, 0, set()
+    try:
+        with open(os.devnull, 'w') as devnull:
+            log = subprocess.check_output(
+                ['git', 'log', '--format=%H %at', 'refs/heads/master', '--'],
+                cwd=repo, stderr=devnull).split()
+    except subprocess.CalledProcessError:
+        return None, 0, set()
+    days = set(date.fromtimestamp(int(stamp)).toordinal()
+               for stamp in log[1::2])
+    return (log[0] if log else None), len(log) / 2, days
+
+
+build_backends = {
+    'fast-import': build_fast_import,
+    'pack': build_pack,
+    'plumbing': build_plumbing,
+}
+
+
+class ByteCounter(object):
+    """A file-like object that only counts the bytes written to it."""
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+
+
+def get_script_size(conf, data_out, backend):
+    """Returns the size of the bash script BACKEND would create."""
+
+    counter = ByteCounter()
+    write_script(dict(conf, backend=backend), data_out,
+                 create_template(conf), counter)
+    return counter.size
+
+
+def get_sample_dataset(commits):
+    """Returns a data set of COMMITS commits on consecutive days."""
+
+    start = date(2016, 1, 1).toordinal()
+    return [{'date': date.fromordinal(start + i).isoformat() + 'T12:00:00',
+             'count': 1} for i in xrange(commits)]
+
+
+def build_sample(conf, backend, wdir, commits):
+    """Builds a repository of COMMITS commits with BACKEND in WDIR.
+
+    Nothing is pushed. Returns the time it took and the size of the
+    objects of the repository.
+    """
+
+    sample_conf = dict(conf, backend=backend, wdir=wdir, dryrun=True,
+                       repo='sample{0}_{1}'.format(commits, backend))
+    data_out = get_sample_dataset(commits)
+    start = time.time()
+    if backend in script_backends:
+        template = create_template(sample_conf).split('{2}', 1)[0] + '{2}\n'
+        create_script(sample_conf, data_out, template)
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call(['sh', './ghdecoy.sh'], cwd=wdir,
+                                  stdout=devnull)
+    else:
+        build_backends[backend](sample_conf, data_out)
+    seconds = time.time() - start
+    objects = os.path.join(wdir, sample_conf['repo'], '.git', 'objects')
+    size = 0
+    for path, dirs, files in os.walk(objects):
+        size += sum(os.path.getsize(os.path.join(path, name))
+                    for name in files if not name.endswith('.idx'))
+    return seconds, size
+
+
+backend_costs = {}
+
+
+def get_backend_costs(conf, sizes=(2, 12), script_sizes=(2, 12)):
+    """Measures the cost of every backend by building two sample repos.
+
+    The script backends are sampled with script_sizes commits since they
+    are a lot slower than the others.
+
+    Returns a dict mapping the backends to (seconds per commit, seconds of
+    overhead) tuples plus the key 'bytes' holding the number of bytes per
+    commit and of overhead of the objects written by the pack backend. The
+    results are computed once per language and process.
+    """
+
+    if conf['lang'] in backend_costs:
+        return backend_costs[conf['lang']]
+
+    wdir = tempfile.mkdtemp(prefix='ghdecoy-estimate-')
+    costs = {}
+    try:
+        for backend in known_backends:
+            if backend in script_backends:
+                first, last = script_sizes
+            else:
+                first, last = sizes
+            small = build_sample(conf, backend, wdir, first)
+            large = build_sample(conf, backend, wdir, last)
+            for key, small_cost, large_cost in (
+                    (backend, small[0], large[0]),
+                    ('bytes', small[1], large[1])):
+                if key == 'bytes' and backend != 'pack':
+                    continue
+                per_commit = (max(0, large_cost - small_cost) /
+                              float(last - first))
+                costs[key] = (per_commit,
+                              max(0, small_cost - per_commit * first))
+    finally:
+        shutil.rmtree(wdir, True)
+    backend_costs[conf['lang']] = costs
+    return costs
+
+
+def print_estimate(conf, data_out):
+    """Prints the predicted cost of building and pushing the data set."""
+
+    commits = sum(entry['count'] for entry in data_out)
+    largest = max(data_out, key=lambda entry: entry['count'])
+    costs = get_backend_costs(conf, (10, 100))
+
+    print "Estimate for {0}/{1}:".format(conf['user'], conf['repo'])
+    print "  days:        {0}".format(
+        sum(1 for entry in data_out if entry['count']))
+    print "  commits:     {0}".format(commits)
+    print "  largest day: {0} commits on {1}".format(largest['count'],
+                                                     largest['date'][:10])
+    for backend in script_backends:
+        print "  ghdecoy.sh:  {0} bytes ({1})".format(
+            get_script_size(conf, data_out, backend), backend)
+    per_commit, overhead = costs['bytes']
+    print "  push size:   ~{0} bytes".format(int(overhead + per_commit * commits))
+    for backend in known_backends:
+        per_commit, overhead = costs[backend]
+        print "  build time:  ~{0:.1f}s ({1}){2}".format(
+            overhead + per_commit * commits, backend,
+            ' *' if backend == conf['backend'] else '')
+
+
+def run(conf, data_in=None):
+    """Creates and pushes the decoy repository for a single user.
+
+    data_in is the user's parsed contribution data; it is fetched if None.
+    Returns the exit status and the number of commits that were created.
+    """
+
+    ret = 0
+
+    repo = os.path.join(conf['wdir'], conf['repo'])
+    if (conf['push_chunk'] and not conf['dryrun'] and
+            os.path.exists(get_checkpoint_path(repo))):
+        print "Resuming the interrupted push of {0}".format(repo)
+        try:
+            commits = push_chunks(conf, repo)
+        except (subprocess.CalledProcessError, OSError) as err:
+            print err
+            return 1, 0
+        if not conf['keep'] and not conf['incremental']:
+            shutil.rmtree(repo, True)
+        return ret, commits
+
+    if data_in is None:
+        fetcher = get_fetcher(conf)
+        data_in = fetcher.get_contributions(conf['user'])
+        fetcher.evict_cache()
+        if data_in is None:
+            return 1, 0
+
+    data_out = create_dataset(data_in, conf['action'],
                               conf['min_days'], conf['max_shade'],
                               conf['force_data'], conf['timeframe'],
-                              conf['workday'])
-    if not data_out:
+                              conf['workday'], conf['holidays'], None,
+                              get_seed(conf['user'], conf['repo'],
+                                       conf['seed_salt']))
+    planned, scaled = scale_dataset(as_calendar(data_in), data_out,
+                                    conf['planner'])
+    if conf['planner'] == 'shade' and not conf['estimate']:
+        print "Planned {} commits instead of {} ({} saved)".format(
+            planned, scaled, scaled - planned)
+    parent, start, days = None, 0, set()
+    removed = 0
+    unpushed = False
+    if conf['incremental']:
+        remote = None
+        if not conf['dryrun']:
+            try:
+                remote = sync_repo(conf)
+            except (subprocess.CalledProcessError, OSError) as err:
+                print err
+                return 1, 0
+        if conf['compact_history'] and not conf['estimate']:
+            try:
+                removed = compact_history(repo, as_calendar(data_in).start)
+            except (subprocess.CalledProcessError, OSError) as err:
+                print err
+                return 1, 0
+            if removed:
+                print "Removed {0} commits older than the calendar".format(
+                    removed)
+        parent, start, days = get_repo_history(repo)
+        data_out = [entry for entry in data_out
+                    if entry['count'] and get_ordinal(entry['date']) not in days]
+        unpushed = not (conf['dryrun'] or conf['estimate'] or
+                        conf['bundle'] or parent == remote)
+        if unpushed and not removed:
+            print "Pushing the commits of an earlier run that were not pushed"
+    commits = sum(entry['count'] for entry in data_out)
+    if not commits and not (parent and (removed or unpushed)):
         print "No commits to be pushed."
-        sys.exit(ret)
+        return ret, 0
 
-    create_script(conf, data_out, create_template(conf))
+    if conf['estimate']:
+        try:
+            print_estimate(conf, data_out)
+        except (subprocess.CalledProcessError, OSError) as err:
+            print err
+            ret = 1
+        return ret, commits
 
     os.chdir(conf['wdir'])
-    try:
-        subprocess.check_call(['sh', './ghdecoy.sh'])
-    except subprocess.CalledProcessError as err:
-        print err
-        ret = 1
+    if conf['backend'] in script_backends:
+        create_script(conf, data_out, create_template(conf), start)
+        try:
+            subprocess.check_call(['sh', './ghdecoy.sh'])
+            if conf['bundle']:
+                print "Wrote {0}".format(create_bundle(conf, repo, parent))
+            elif conf['push_chunk'] and not conf['dryrun']:
+                push_chunks(conf, repo)
+        except (subprocess.CalledProcessError, OSError) as err:
+            print err
+            ret = 1
+    else:
+        try:
+            if data_out:
+                build_backends[conf['backend']](conf, data_out, parent,
+                                                start)
+            if conf['bundle']:
+                print "Wrote {0}".format(create_bundle(conf, repo, parent))
+            else:
+                publish_repo(conf)
+        except (subprocess.CalledProcessError, OSError) as err:
+            print err
+            ret = 1
 
     if not conf['keep']:
-        shutil.rmtree(conf['repo'], True)
-        os.remove('ghdecoy.sh')
+        if not conf['incremental']:
+            shutil.rmtree(repo, True)
+        if conf['backend'] in script_backends:
+            os.remove(os.path.join(conf['wdir'], 'ghdecoy.sh'))
+
+    return ret, commits
+
+
+def parse_batch(conf, lines):
+    """Parses the lines of a batch file into one configuration per user.
+
+    Every line is parsed like a command line following the global arguments.
+    Returns a list of (line, conf) tuples where conf is None for lines that
+    could not be parsed.
+    """
+
+    ret = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            user_conf = parse_args(['ghdecoy.py'] + conf['args'] +
+                                   shlex.split(line), False)
+        except (SystemExit, ValueError):
+            user_conf = None
+        if user_conf and user_conf['batch']:
+            user_conf = None
+        if user_conf:
+            user_conf['wdir'] = os.path.join(
+                os.path.abspath(user_conf['wdir']),
+                '{0}_{1}'.format(user_conf['user'], user_conf['repo']))
+        ret.append((line, user_conf))
+    return ret
+
+
+def run_batch_job(job):
+    """Processes one user of a batch and returns a result summary.
+
+    job is a tuple of the user's configuration and its prefetched
+    contribution data.
+    """
+
+    conf, data_in = job
+    result = {
+        'user': conf['user'],
+        'repo': conf['repo'],
+        'ret': 1,
+        'commits': 0,
+    }
+    start = time.time()
+    try:
+        if not os.path.isdir(conf['wdir']):
+            os.makedirs(conf['wdir'])
+        result['ret'], result['commits'] = run(conf, data_in)
+    except Exception as err:
+        print "{0}: {1}".format(conf['user'], err)
+    result['seconds'] = time.time() - start
+    return result
+
 
-    sys.exit(ret)
+def run_batch(conf):
+    """Processes all users of a batch file in a pool of worker processes.
+
+    Failing users do not stop the batch; a summary of all results is printed
+    at the end. Returns 0 if all users were processed successfully.
+    """
+
+    if conf['batch'] == '-':
+        lines = sys.stdin.readlines()
+    else:
+        with open(conf['batch']) as batch_fo:
+            lines = batch_fo.readlines()
+    jobs = parse_batch(conf, lines)
+
+    results = []
+    for line, user_conf in jobs:
+        if not user_conf:
+            print "Invalid batch entry: {}".format(line)
+            results.append({'user': line, 'repo': '-', 'ret': 1,
+                            'commits': 0, 'seconds': 0.0})
+
+    start = time.time()
+    confs = [user_conf for line, user_conf in jobs if user_conf]
+    fetcher = get_fetcher(conf)
+    cals = fetcher.fetch_many([c['user'] for c in confs], conf['fetch_jobs'])
+    for user_conf in confs:
+        if cals[user_conf['user']] is None:
+            results.append({'user': user_conf['user'],
+                            'repo': user_conf['repo'], 'ret': 1,
+                            'commits': 0, 'seconds': 0.0})
+    pool = multiprocessing.Pool(conf['jobs'])
+    try:
+        results.extend(pool.imap_unordered(
+            run_batch_job, [(c, cals[c['user']]) for c in confs
+                            if cals[c['user']] is not None]))
+    finally:
+        pool.close()
+        pool.join()
+    elapsed = max(time.time() - start, 0.001)
+
+    failed = 0
+    commits = 0
+    print "{0:20} {1:20} {2:6} {3:>8} {4:>8}".format(
+        'user', 'repo', 'result', 'commits', 'seconds')
+    for result in results:
+        if result['ret']:
+            failed += 1
+        commits += result['commits']
+        print "{0:20} {1:20} {2:6} {3:>8} {4:>8.1f}".format(
+            result['user'], result['repo'],
+            'failed' if result['ret'] else 'ok', result['commits'],
+            result['seconds'])
+    print ("Processed {0} users ({1} ok, {2} failed) in {3:.1f}s: "
+           "{4:.2f} users/s, {5:.1f} commits/s").format(
+               len(results), len(results) - failed, failed, elapsed,
+               len(results) / elapsed, commits / elapsed)
+    print ("Fetched {0} bytes of contribution data "
+           "({1} bytes on the wire)").format(fetcher.data_bytes,
+                                             fetcher.wire_bytes)
+
+    return 1 if failed else 0
+
+
+def main():
+    """The scripts main function."""
+
+    conf = parse_args(sys.argv)
+    if conf['batch']:
+        sys.exit(run_batch(conf))
+    sys.exit(run(conf)[0])
 
 
 if __name__ == '__main__':
@@ -2,6 +2,96 @@ import unittest
 import ghdecoy
 import os
 import datetime
+import shutil
+import subprocess
+import StringIO
+import threading
+import zlib
+import BaseHTTPServer
+import SocketServer
+
+
+def make_calendar_page(days=371, start=datetime.date(2015, 1, 1)):
+    """Returns the lines of a contributions page with the given days."""
+
+    lines = ['<!DOCTYPE html>\n', '<html>\n']
+    lines.extend(['<!-- padding -->\n'] * 60)
+    lines.append('<svg width="721" height="110" '
+                 'class="js-calendar-graph-svg">\n')
+    for i in range(days):
+        if i % 7 == 0:
+            lines.append('<g transform="translate({0}, 0)">\n'.format(
+                i / 7 * 13))
+        lines.append(
+            '<rect class="day" width="11" height="11" y="{0}" '
+            'fill="#eeeeee" data-count="{1}" data-date="{2}"/>\n'.format(
+                i % 7 * 13, i % 5,
+                (start + datetime.timedelta(days=i)).isoformat()))
+        if i % 7 == 6:
+            lines.append('</g>\n')
+    lines.append('</svg>\n')
+    lines.extend(['<!-- padding -->\n'] * 20)
+    lines.append('</html>\n')
+    return lines
+
+
+class CalendarHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves fake contribution pages for the fetch tests."""
+
+    protocol_version = 'HTTP/1.1'
+    connections = 0
+    requests = []
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        CalendarHandler.connections += 1
+
+    def do_GET(self):
+        CalendarHandler.requests.append((self.path, dict(self.headers)))
+        if self.path == '/redirect':
+            self.send_response(302)
+            self.send_header('Location', '/users/alice/contributions')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if not self.path.startswith('/users/') or 'missing' in self.path:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.send_header('ETag', '"v1"')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = ''.join(make_calendar_page())
+        self.send_response(200)
+        accept = self.headers.get('Accept-Encoding', '')
+        if 'plain' in self.path or 'gzip' not in accept:
+            pass
+        elif 'zlib' in self.path:
+            body = zlib.compress(body)
+            self.send_header('Content-Encoding', 'deflate')
+        elif 'deflate' in self.path:
+            body = zlib.compress(body)[2:-4]
+            self.send_header('Content-Encoding', 'deflate')
+        else:
+            obj = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            body = obj.compress(body) + obj.flush()
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('ETag', '"v1"')
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class CalendarServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
 
 
 class GHDecoyOnlineTests(unittest.TestCase):
@@ -22,6 +112,12 @@ class GHDecoyIOTests(unittest.TestCase):
 
     outfile = "/tmp/ghdecoy.sh"
 
+    @classmethod
+    def setUpClass(cls):
+        for var in ('GIT_AUTHOR', 'GIT_COMMITTER'):
+            os.environ[var + '_NAME'] = 'ghdecoy'
+            os.environ[var + '_EMAIL'] = 'ghdecoy@example.com'
+
     def test_create_script(self):
         conf = {
             'lang': 'raw',
@@ -65,25 +161,25 @@ class GHDecoyIOTests(unittest.TestCase):
             'touch decoy\n',
             'git add decoy\n',
             'echo 0 > decoy\n',
-            'GIT_AUTHOR_DATE=2015-01-01T12:00:00 GIT_COMMITTER_DATE=2015-01-01T12:00:00 git commit -a -m "ghdecoy" > /dev/null\n',
+            'GIT_AUTHOR_DATE=2015-01-01T12:00:00 GIT_COMMITTER_DATE=2015-01-01T12:00:00 git commit -a --allow-empty -m "ghdecoy" > /dev/null\n',
             'echo 1 > decoy\n',
-            'GIT_AUTHOR_DATE=2015-01-02T12:00:00 GIT_COMMITTER_DATE=2015-01-02T12:00:00 git commit -a -m "ghdecoy" > /dev/null\n',
+            'GIT_AUTHOR_DATE=2015-01-02T12:00:00 GIT_COMMITTER_DATE=2015-01-02T12:00:00 git commit -a --allow-empty -m "ghdecoy" > /dev/null\n',
             'echo 2 > decoy\n',
-            'GIT_AUTHOR_DATE=2015-01-02T12:00:00 GIT_COMMITTER_DATE=2015-01-02T12:00:00 git commit -a -m "ghdecoy" > /dev/null\n',
+            'GIT_AUTHOR_DATE=2015-01-02T12:00:00 GIT_COMMITTER_DATE=2015-01-02T12:00:00 git commit -a --allow-empty -m "ghdecoy" > /dev/null\n',
             'echo 3 > decoy\n',
-            'GIT_AUTHOR_DATE=2015-01-03T12:00:00 GIT_COMMITTER_DATE=2015-01-03T12:00:00 git commit -a -m "ghdecoy" > /dev/null\n',
+            'GIT_AUTHOR_DATE=2015-01-03T12:00:00 GIT_COMMITTER_DATE=2015-01-03T12:00:00 git commit -a --allow-empty -m "ghdecoy" > /dev/null\n',
             'echo 4 > decoy\n',
-            'GIT_AUTHOR_DATE=2015-01-03T12:00:00 GIT_COMMITTER_DATE=2015-01-03T12:00:00 git commit -a -m "ghdecoy" > /dev/null\n',
+            'GIT_AUTHOR_DATE=2015-01-03T12:00:00 GIT_COMMITTER_DATE=2015-01-03T12:00:00 git commit -a --allow-empty -m "ghdecoy" > /dev/null\n',
             'echo 5 > decoy\n',
-            'GIT_AUTHOR_DATE=2015-01-03T12:00:00 GIT_COMMITTER_DATE=2015-01-03T12:00:00 git commit -a -m "ghdecoy" > /dev/null\n',
+            'GIT_AUTHOR_DATE=2015-01-03T12:00:00 GIT_COMMITTER_DATE=2015-01-03T12:00:00 git commit -a --allow-empty -m "ghdecoy" > /dev/null\n',
             'echo 6 > decoy\n',
-            'GIT_AUTHOR_DATE=2015-01-04T12:00:00 GIT_COMMITTER_DATE=2015-01-04T12:00:00 git commit -a -m "ghdecoy" > /dev/null\n',
+            'GIT_AUTHOR_DATE=2015-01-04T12:00:00 GIT_COMMITTER_DATE=2015-01-04T12:00:00 git commit -a --allow-empty -m "ghdecoy" > /dev/null\n',
             'echo 7 > decoy\n',
-            'GIT_AUTHOR_DATE=2015-01-04T12:00:00 GIT_COMMITTER_DATE=2015-01-04T12:00:00 git commit -a -m "ghdecoy" > /dev/null\n',
+            'GIT_AUTHOR_DATE=2015-01-04T12:00:00 GIT_COMMITTER_DATE=2015-01-04T12:00:00 git commit -a --allow-empty -m "ghdecoy" > /dev/null\n',
             'echo 8 > decoy\n',
-            'GIT_AUTHOR_DATE=2015-01-04T12:00:00 GIT_COMMITTER_DATE=2015-01-04T12:00:00 git commit -a -m "ghdecoy" > /dev/null\n',
+            'GIT_AUTHOR_DATE=2015-01-04T12:00:00 GIT_COMMITTER_DATE=2015-01-04T12:00:00 git commit -a --allow-empty -m "ghdecoy" > /dev/null\n',
             'echo 9 > decoy\n',
-            'GIT_AUTHOR_DATE=2015-01-04T12:00:00 GIT_COMMITTER_DATE=2015-01-04T12:00:00 git commit -a -m "ghdecoy" > /dev/null\n',
+            'GIT_AUTHOR_DATE=2015-01-04T12:00:00 GIT_COMMITTER_DATE=2015-01-04T12:00:00 git commit -a --allow-empty -m "ghdecoy" > /dev/null\n',
             '\n',
             'git remote add origin git@github.com:tickelton/$REPO.git\n',
             'set +e\n',
@@ -100,11 +196,798 @@ class GHDecoyIOTests(unittest.TestCase):
         self.maxDiff = None
         self.assertListEqual(result, readback)
 
+    def build_repo(self, backend):
+        conf = {
+            'lang': 'c',
+            'wdir': '/tmp',
+            'repo': 'ghdecoy-test-' + backend,
+        }
+        data = [
+            {'date': '2015-01-01T12:00:00', 'count': 1},
+            {'date': '2015-01-02T12:00:00', 'count': 2},
+            {'date': '2015-01-03T12:00:00', 'count': 0},
+        ]
+        repo = os.path.join(conf['wdir'], conf['repo'])
+        shutil.rmtree(repo, True)
+        try:
+            ghdecoy.build_backends[backend](conf, data)
+            subprocess.check_call(['git', 'fsck', '--strict'],
+                                  cwd=repo)
+            ret = {
+                'head': subprocess.check_output(
+                    ['git', 'rev-parse', 'master'], cwd=repo).strip(),
+                'count': subprocess.check_output(
+                    ['git', 'rev-list', '--count', 'master'],
+                    cwd=repo).strip(),
+                'dates': subprocess.check_output(
+                    ['git', 'log', '--format=%ad', '--date=short'],
+                    cwd=repo).split(),
+                'status': subprocess.check_output(
+                    ['git', 'status', '--porcelain'], cwd=repo),
+            }
+            with open(os.path.join(repo, 'decoy.c')) as decoy:
+                ret['content'] = decoy.read()
+        finally:
+            shutil.rmtree(repo, True)
+        return ret
+
+    def test_build_fast_import(self):
+        ret = self.build_repo('fast-import')
+        self.assertEqual(ret['count'], '3')
+        self.assertListEqual(ret['dates'], ['2015-01-02', '2015-01-02',
+                                            '2015-01-01'])
+        self.assertEqual(ret['status'], '')
+        self.assertEqual(ret['content'], ghdecoy.render_content('c', 2))
+
+    def test_build_pack(self):
+        ret = self.build_repo('pack')
+        self.assertEqual(ret['count'], '3')
+        self.assertListEqual(ret['dates'], ['2015-01-02', '2015-01-02',
+                                            '2015-01-01'])
+        self.assertEqual(ret['status'], '')
+        self.assertEqual(ret['content'], ghdecoy.render_content('c', 2))
+
+    def test_build_plumbing(self):
+        ret = self.build_repo('plumbing')
+        self.assertEqual(ret['count'], '3')
+        self.assertListEqual(ret['dates'], ['2015-01-02', '2015-01-02',
+                                            '2015-01-01'])
+        self.assertEqual(ret['status'], '')
+        self.assertEqual(ret['content'], ghdecoy.render_content('c', 2))
+
+    def test_build_backends_no_commits(self):
+        data = [
+            {'date': '2015-01-01T12:00:00', 'count': 0},
+            {'date': '2015-01-02T12:00:00', 'count': 0},
+        ]
+        for backend in ghdecoy.known_backends:
+            conf = ghdecoy.parse_args(
+                ['./ghdecoy.py', '-u', 'tickelton', '-l', 'c', '-n', '-b',
+                 backend, '-r', 'ghdecoy-test-empty', 'fill'])
+            repo = os.path.join(conf['wdir'], conf['repo'])
+            shutil.rmtree(repo, True)
+            try:
+                if backend in ghdecoy.script_backends:
+                    ghdecoy.create_script(conf, data,
+                                          ghdecoy.create_template(conf))
+                    with open(os.devnull, 'w') as devnull:
+                        subprocess.check_call(['sh', self.outfile],
+                                              cwd=conf['wdir'],
+                                              stdout=devnull)
+                else:
+                    ghdecoy.build_backends[backend](conf, data)
+                history = ghdecoy.get_repo_history(repo)
+            finally:
+                shutil.rmtree(repo, True)
+            self.assertEqual(history[:2], (None, 0), backend)
+
+    def test_build_backends_identical_history(self):
+        head = self.build_repo('fast-import')['head']
+        self.assertEqual(self.build_repo('pack')['head'], head)
+        self.assertEqual(self.build_repo('plumbing')['head'], head)
+
+    def build_incremental(self, backend):
+        conf = ghdecoy.parse_args(
+            ['./ghdecoy.py', '-u', 'tickelton', '-l', 'c', '-n', '-b',
+             backend, '-d', '/tmp', '-r', 'ghdecoy-test-incremental',
+             '--incremental', 'fill'])
+        runs = [
+            [{'date': '2015-01-01T12:00:00', 'count': 1},
+             {'date': '2015-01-02T12:00:00', 'count': 2}],
+            [{'date': '2015-01-03T12:00:00', 'count': 0},
+             {'date': '2015-01-04T12:00:00', 'count': 2}],
+        ]
+        repo = os.path.join(conf['wdir'], conf['repo'])
+        shutil.rmtree(repo, True)
+        try:
+            heads = []
+            for data in runs:
+                parent, start, days = ghdecoy.get_repo_history(repo)
+                if backend in ghdecoy.script_backends:
+                    ghdecoy.create_script(conf, data,
+                                          ghdecoy.create_template(conf),
+                                          start)
+                    with open(os.devnull, 'w') as devnull:
+                        subprocess.check_call(['sh', self.outfile],
+                                              cwd=conf['wdir'],
+                                              stdout=devnull)
+                else:
+                    ghdecoy.build_backends[backend](conf, data, parent,
+                                                    start)
+                    ghdecoy.publish_repo(conf)
+                heads.append(ghdecoy.get_repo_history(repo)[0])
+            subprocess.check_call(['git', 'fsck', '--strict'], cwd=repo)
+            history = ghdecoy.get_repo_history(repo)
+            first_parent = subprocess.check_output(
+                ['git', 'rev-parse', 'master~2'], cwd=repo).strip()
+            status = subprocess.check_output(
+                ['git', 'status', '--porcelain'], cwd=repo)
+        finally:
+            shutil.rmtree(repo, True)
+        self.assertEqual(first_parent, heads[0])
+        self.assertEqual(history[0], heads[1])
+        self.assertEqual(history[1], 5)
+        self.assertSetEqual(history[2], set(
+            datetime.date(2015, 1, day).toordinal() for day in (1, 2, 4)))
+        self.assertEqual(status, '')
+        return history[0]
+
+    def test_build_incremental(self):
+        heads = [self.build_incremental(backend)
+                 for backend in ghdecoy.known_backends]
+        self.assertEqual(len(set(heads)), 1)
+
+    remote_dir = '/tmp/ghdecoy-test-remote'
+
+    def create_remote(self, wdir):
+        """Creates a bare repository github URLs of user tickelton are
+        redirected to and returns its path.
+        """
+
+        remote = os.path.join(self.remote_dir, 'tickelton', 'decoy.git')
+        for path in (self.remote_dir, wdir):
+            shutil.rmtree(path, True)
+        os.makedirs(wdir)
+        subprocess.check_call(['git', 'init', '-q', '--bare', remote])
+        subprocess.check_call(['git', 'config', 'uploadpack.allowFilter',
+                               'true'], cwd=remote)
+        os.environ.update({
+            'GIT_CONFIG_COUNT': '1',
+            'GIT_CONFIG_KEY_0': 'url.file://{0}/.insteadOf'.format(
+                self.remote_dir),
+            'GIT_CONFIG_VALUE_0': 'https://github.com/',
+        })
+        return remote
+
+    def remove_remote(self, wdir):
+        for var in ('COUNT', 'KEY_0', 'VALUE_0'):
+            del os.environ['GIT_CONFIG_' + var]
+        for path in (self.remote_dir, wdir):
+            shutil.rmtree(path, True)
+
+    def test_sync_repo(self):
+        wdir = '/tmp/ghdecoy-test-sync'
+        self.create_remote(wdir)
+        argv = ['./ghdecoy.py', '-u', 'tickelton', '-b', 'pack', '-d', wdir,
+                'fill']
+        first = [{'date': '2015-01-01T12:00:00', 'count': 2}]
+        second = [{'date': '2015-01-02T12:00:00', 'count': 1}]
+        repo = os.path.join(wdir, 'decoy')
+        try:
+            conf = ghdecoy.parse_args(argv)
+            ghdecoy.build_pack(conf, first)
+            ghdecoy.publish_repo(conf)
+            pushed = ghdecoy.get_remote_head(repo)
+            shutil.rmtree(repo)
+
+            conf = ghdecoy.parse_args(argv[:-1] + ['--incremental', 'fill'])
+            ghdecoy.sync_repo(conf)
+            synced = ghdecoy.get_repo_history(repo)
+            ghdecoy.build_pack(conf, second, synced[0], synced[1])
+            ghdecoy.publish_repo(conf)
+            history = ghdecoy.get_repo_history(repo)
+            remote_head = ghdecoy.get_remote_head(repo)
+        finally:
+            self.remove_remote(wdir)
+        self.assertEqual(synced[0], pushed)
+        self.assertEqual(synced[1], 2)
+        self.assertEqual(history[1], 3)
+        self.assertEqual(remote_head, history[0])
+
+    def test_push_chunks(self):
+        wdir = '/tmp/ghdecoy-test-chunks'
+        self.create_remote(wdir)
+        conf = ghdecoy.parse_args(['./ghdecoy.py', '-u', 'tickelton', '-d',
+                                   wdir, '--push-chunk', '2', 'fill'])
+        repo = os.path.join(wdir, 'decoy')
+        try:
+            ghdecoy.build_pack(conf, [
+                {'date': '2015-01-01T12:00:00', 'count': 3},
+                {'date': '2015-01-02T12:00:00', 'count': 2},
+            ])
+            ghdecoy.publish_repo(conf)
+            checkpoint = os.path.exists(ghdecoy.get_checkpoint_path(repo))
+            local_head = ghdecoy.get_repo_history(repo)[0]
+            remote_head = ghdecoy.get_remote_head(repo)
+        finally:
+            self.remove_remote(wdir)
+        self.assertFalse(checkpoint)
+        self.assertEqual(remote_head, local_head)
+
+    def test_push_chunks_resume(self):
+        wdir = '/tmp/ghdecoy-test-chunks'
+        self.create_remote(wdir)
+        conf = ghdecoy.parse_args(['./ghdecoy.py', '-u', 'tickelton', '-d',
+                                   wdir, '-k', '--push-chunk', '2', 'fill'])
+        repo = os.path.join(wdir, 'decoy')
+        cwd = os.getcwd()
+        try:
+            ghdecoy.build_pack(conf, [
+                {'date': '2015-01-01T12:00:00', 'count': 5},
+            ])
+            subprocess.check_call(['git', 'remote', 'add', 'origin',
+                                   ghdecoy.get_remote_url(conf)], cwd=repo)
+            subprocess.check_call(['git', 'push', '-q', 'origin',
+                                   'master~3:refs/heads/master'], cwd=repo)
+            ghdecoy.write_checkpoint(
+                ghdecoy.get_checkpoint_path(repo),
+                ghdecoy.get_remote_head(repo))
+            ret = ghdecoy.run(conf)
+            local_head = ghdecoy.get_repo_history(repo)[0]
+            remote_head = ghdecoy.get_remote_head(repo)
+            checkpoint = os.path.exists(ghdecoy.get_checkpoint_path(repo))
+        finally:
+            os.chdir(cwd)
+            self.remove_remote(wdir)
+        self.assertTupleEqual(ret, (0, 3))
+        self.assertFalse(checkpoint)
+        self.assertEqual(remote_head, local_head)
+
+    def test_run_bundle(self):
+        wdir = '/tmp/ghdecoy-test-bundle'
+        cal = ghdecoy.Calendar(datetime.date(2015, 1, 1).toordinal(),
+                               [4] + [0] * 30)
+        cwd = os.getcwd()
+        for backend in ('script', 'pack'):
+            shutil.rmtree(wdir, True)
+            os.makedirs(wdir)
+            conf = ghdecoy.parse_args(
+                ['./ghdecoy.py', '-u', 'tickelton', '-d', wdir, '-m', '1',
+                 '-b', backend, '--bundle', 'fill'])
+            try:
+                ret, commits = ghdecoy.run(conf, cal)
+                bundle = os.path.join(wdir, 'decoy.bundle')
+                clone = os.path.join(wdir, 'clone')
+                subprocess.check_call(['git', 'clone', '-q', bundle, clone])
+                count = subprocess.check_output(
+                    ['git', 'rev-list', '--count', 'master'],
+                    cwd=clone).strip()
+                created = sorted(os.listdir(wdir))
+            finally:
+                os.chdir(cwd)
+                shutil.rmtree(wdir, True)
+            self.assertEqual(ret, 0)
+            self.assertEqual(int(count), commits)
+            self.assertListEqual(created, ['clone', 'decoy.bundle'])
+
+    def test_run_incremental_unpushed(self):
+        wdir = '/tmp/ghdecoy-test-unpushed'
+        remote = self.create_remote(wdir)
+        hook = os.path.join(remote, 'hooks', 'pre-receive')
+        with open(hook, 'w') as hook_fo:
+            hook_fo.write('#!/bin/sh\nexit 1\n')
+        os.chmod(hook, 0755)
+        cal = ghdecoy.Calendar(datetime.date(2015, 1, 1).toordinal(),
+                               [4] + [0] * 30)
+        cwd = os.getcwd()
+        argv = ['./ghdecoy.py', '-u', 'tickelton', '-d', wdir, '-m', '1',
+                '-b', 'pack', '--incremental', 'fill']
+        repo = os.path.join(wdir, 'decoy')
+        try:
+            with open(os.devnull, 'w') as devnull:
+                stderr = os.dup(2)
+                os.dup2(devnull.fileno(), 2)
+                try:
+                    failed = ghdecoy.run(ghdecoy.parse_args(argv), cal)
+                finally:
+                    os.dup2(stderr, 2)
+                    os.close(stderr)
+            os.chdir(cwd)
+            os.remove(hook)
+            ret, commits = ghdecoy.run(ghdecoy.parse_args(argv), cal)
+            local = ghdecoy.get_repo_history(repo)[0]
+            pushed = ghdecoy.get_remote_head(repo)
+        finally:
+            os.chdir(cwd)
+            self.remove_remote(wdir)
+        self.assertEqual(failed[0], 1)
+        self.assertEqual(ret, 0)
+        self.assertEqual(commits, 0)
+        self.assertEqual(pushed, local)
+
+    def test_compact_history(self):
+        conf = {'lang': 'c', 'wdir': '/tmp', 'repo': 'ghdecoy-test-compaction'}
+        repo = os.path.join(conf['wdir'], conf['repo'])
+        shutil.rmtree(repo, True)
+        try:
+            ghdecoy.build_pack(conf, [
+                {'date': '2015-01-05T12:00:00', 'count': 1},
+                {'date': '2015-01-01T12:00:00', 'count': 2},
+                {'date': '2015-01-06T12:00:00', 'count': 1},
+                {'date': '2015-01-02T12:00:00', 'count': 1},
+                {'date': '2015-01-07T12:00:00', 'count': 1},
+            ])
+            log = ['git', 'log', '--reverse', '--format=%H %T %ad',
+                   '--date=short']
+            before = subprocess.check_output(log, cwd=repo).splitlines()
+            self.assertEqual(ghdecoy.compact_history(
+                repo, datetime.date(2015, 1, 1).toordinal()), 0)
+            removed = ghdecoy.compact_history(
+                repo, datetime.date(2015, 1, 3).toordinal())
+            after = subprocess.check_output(log, cwd=repo).splitlines()
+            subprocess.check_call(['git', 'fsck', '--strict'], cwd=repo)
+            status = subprocess.check_output(
+                ['git', 'status', '--porcelain'], cwd=repo)
+        finally:
+            shutil.rmtree(repo, True)
+        self.assertEqual(removed, 3)
+        self.assertEqual(after[0], before[0])
+        self.assertListEqual([line.split()[1:] for line in after],
+                             [before[i].split()[1:] for i in (0, 3, 5)])
+        self.assertEqual(status, '')
+
+    def test_compact_history_push(self):
+        wdir = '/tmp/ghdecoy-test-compaction'
+        self.create_remote(wdir)
+        conf = ghdecoy.parse_args(
+            ['./ghdecoy.py', '-u', 'tickelton', '-b', 'pack', '-d', wdir,
+             '--incremental', '--compact-history', 'fill'])
+        repo = os.path.join(wdir, 'decoy')
+        try:
+            ghdecoy.build_pack(conf, [
+                {'date': '2015-01-01T12:00:00', 'count': 2},
+                {'date': '2015-01-05T12:00:00', 'count': 1},
+            ])
+            ghdecoy.publish_repo(conf)
+            ghdecoy.compact_history(repo,
+                                    datetime.date(2015, 1, 3).toordinal())
+            ghdecoy.publish_repo(conf)
+            history = ghdecoy.get_repo_history(repo)
+            remote_head = ghdecoy.get_remote_head(repo)
+        finally:
+            self.remove_remote(wdir)
+        self.assertEqual(history[1], 1)
+        self.assertEqual(remote_head, history[0])
+
+    def test_compact_history_all(self):
+        wdir = '/tmp/ghdecoy-test-compaction'
+        cal = ghdecoy.Calendar(datetime.date(2015, 2, 1).toordinal(),
+                               [4] + [0] * 30)
+        cwd = os.getcwd()
+        repo = os.path.join(wdir, 'decoy')
+        for backend in ('script', 'pack'):
+            self.create_remote(wdir)
+            conf = ghdecoy.parse_args(
+                ['./ghdecoy.py', '-u', 'tickelton', '-d', wdir, '-m', '1',
+                 '-b', backend, '--incremental', '--compact-history',
+                 'fill'])
+            try:
+                ghdecoy.build_pack(conf, [
+                    {'date': '2015-01-01T12:00:00', 'count': 2},
+                    {'date': '2015-01-05T12:00:00', 'count': 1},
+                ])
+                ghdecoy.publish_repo(conf)
+                ret, commits = ghdecoy.run(conf, cal)
+                subprocess.check_call(['git', 'fsck', '--strict'], cwd=repo)
+                history = ghdecoy.get_repo_history(repo)
+                roots = subprocess.check_output(
+                    ['git', 'rev-list', '--max-parents=0', 'master'],
+                    cwd=repo).split()
+                remote_head = ghdecoy.get_remote_head(repo)
+            finally:
+                os.chdir(cwd)
+                self.remove_remote(wdir)
+            self.assertEqual(ret, 0)
+            self.assertEqual(history[1], commits)
+            self.assertEqual(len(roots), 1)
+            self.assertGreaterEqual(min(history[2]), cal.start)
+            self.assertEqual(remote_head, history[0])
+
+    def test_build_variants(self):
+        data = [
+            {'date': '2015-01-01T12:00:00', 'count': 4},
+            {'date': '2015-01-02T12:00:00', 'count': 3},
+        ]
+        heads = set()
+        for backend in ghdecoy.known_backends:
+            conf = ghdecoy.parse_args(
+                ['./ghdecoy.py', '-u', 'tickelton', '-l', 'c', '-n', '-b',
+                 backend, '-r', 'ghdecoy-test-variants', '--variants', '3',
+                 'fill'])
+            repo = os.path.join(conf['wdir'], conf['repo'])
+            shutil.rmtree(repo, True)
+            try:
+                if backend in ghdecoy.script_backends:
+                    ghdecoy.create_script(conf, data,
+                                          ghdecoy.create_template(conf))
+                    with open(os.devnull, 'w') as devnull:
+                        subprocess.check_call(['sh', self.outfile],
+                                              cwd=conf['wdir'],
+                                              stdout=devnull)
+                else:
+                    ghdecoy.build_backends[backend](conf, data)
+                objects = subprocess.check_output(
+                    ['git', 'rev-list', '--objects', '--no-object-names',
+                     'master'], cwd=repo).split()
+                count = subprocess.check_output(
+                    ['git', 'rev-list', '--count', 'master'],
+                    cwd=repo).strip()
+                heads.add(ghdecoy.get_repo_history(repo)[0])
+            finally:
+                shutil.rmtree(repo, True)
+            self.assertEqual(count, '7')
+            self.assertEqual(len(objects), 7 + 3 + 3)
+        self.assertEqual(len(heads), 1)
+
+    def test_run_relative_wdir(self):
+        cal = ghdecoy.Calendar(datetime.date(2015, 1, 1).toordinal(),
+                               [4] + [0] * 30)
+        cwd = os.getcwd()
+        base = '/tmp/ghdecoy-test-relative'
+        for backend in ghdecoy.known_backends:
+            shutil.rmtree(base, True)
+            os.makedirs(os.path.join(base, 'out'))
+            os.chdir(base)
+            try:
+                conf = ghdecoy.parse_args(
+                    ['./ghdecoy.py', '-u', 'tickelton', '-d', 'out', '-m',
+                     '1', '-n', '-b', backend, 'fill'])
+                ret = ghdecoy.run(conf, cal)[0]
+                created = os.listdir(os.path.join(base, 'out'))
+            finally:
+                os.chdir(cwd)
+                shutil.rmtree(base, True)
+            self.assertEqual(conf['wdir'], os.path.join(base, 'out'))
+            self.assertEqual(ret, 0)
+            self.assertListEqual(created, [])
+
+    def test_get_repo_history_missing(self):
+        self.assertTupleEqual(
+            ghdecoy.get_repo_history('/tmp/ghdecoy-test-missing'),
+            (None, 0, set()))
+
+    def test_create_script_compact(self):
+        conf = {
+            'backend': 'compact',
+            'lang': 'c',
+            'wdir': '/tmp',
+            'repo': 'ghdecoy-test-compact',
+            'user': 'tickelton',
+        }
+        data = [
+            {'date': '2015-01-01T12:00:00', 'count': 1},
+            {'date': '2015-01-02T12:00:00', 'count': 2},
+            {'date': '2015-01-03T12:00:00', 'count': 0},
+        ]
+        template = (
+            '#!/bin/bash\n'
+            'set -e\n'
+            'REPO={0}\n'
+            'git init -q $REPO\n'
+            'cd $REPO\n'
+            'touch decoy{1}\n'
+            'git add decoy{1}\n'
+            '{2}\n'
+        )
+        repo = os.path.join(conf['wdir'], conf['repo'])
+        shutil.rmtree(repo, True)
+        ghdecoy.create_script(conf, data, template)
+        with open(self.outfile, "r") as shfile:
+            script = shfile.read()
+        try:
+            subprocess.check_call(['sh', self.outfile], cwd=conf['wdir'])
+            head = subprocess.check_output(
+                ['git', 'rev-parse', 'master'], cwd=repo).strip()
+        finally:
+            shutil.rmtree(repo, True)
+
+        self.assertEqual(script.count('Hello World'), 1)
+        self.assertIn('2015-01-02T12:00:00 2\n', script)
+        self.assertNotIn('2015-01-03T12:00:00', script)
+        self.assertEqual(head, self.build_repo('fast-import')['head'])
+
+    def test_calendar_cache_evict_size(self):
+        cache_dir = '/tmp/ghdecoy-test-cache'
+        shutil.rmtree(cache_dir, True)
+        try:
+            cache = ghdecoy.CalendarCache(cache_dir, max_age=1e12,
+                                          max_size=10000)
+            for i, user in enumerate(('alice', 'bob', 'carol')):
+                cache.put(user, 'x' * 4000, {})
+                for path in cache.get_paths(user):
+                    os.utime(path, (1000 + i, 1000 + i))
+            stored = [cache.get(user)[0] is not None
+                      for user in ('alice', 'bob', 'carol')]
+            cache.evict()
+            cached = [cache.get(user)[0] is not None
+                      for user in ('alice', 'bob', 'carol')]
+        finally:
+            shutil.rmtree(cache_dir, True)
+        self.assertListEqual(stored, [True, True, True])
+        self.assertListEqual(cached, [False, True, True])
+
+    def test_calendar_cache_evict_age(self):
+        cache_dir = '/tmp/ghdecoy-test-cache'
+        shutil.rmtree(cache_dir, True)
+        try:
+            cache = ghdecoy.CalendarCache(cache_dir, max_age=60)
+            cache.put('alice', 'data', {})
+            cache.put('bob', 'data', {})
+            for path in cache.get_paths('alice'):
+                os.utime(path, (1000, 1000))
+            cache.evict()
+            alice = cache.get('alice')
+            bob = cache.get('bob')
+        finally:
+            shutil.rmtree(cache_dir, True)
+        self.assertTupleEqual(alice, (None, None))
+        self.assertEqual(bob[0], 'data')
+
+    def test_parse_holidays_arg(self):
+        path = '/tmp/ghdecoy-test-holidays'
+        with open(path, 'w') as holidays_fo:
+            holidays_fo.write('# public holidays\n\n20161225\n'
+                              '2016-12-27..2016-12-31\n')
+        conf = {}
+        try:
+            self.assertTrue(ghdecoy.parse_holidays_arg(path, conf))
+        finally:
+            os.remove(path)
+        self.assertListEqual(conf['holidays'], [
+            (datetime.date(2016, 12, 25).toordinal(),
+             datetime.date(2016, 12, 25).toordinal()),
+            (datetime.date(2016, 12, 27).toordinal(),
+             datetime.date(2016, 12, 31).toordinal()),
+        ])
+
+    def test_get_script_size(self):
+        conf = ghdecoy.parse_args(
+            ['./ghdecoy.py', '-u', 'tickelton', '-l', 'c', 'fill'])
+        data = ghdecoy.get_sample_dataset(5)
+        for backend in ghdecoy.script_backends:
+            conf['backend'] = backend
+            ghdecoy.create_script(conf, data, ghdecoy.create_template(conf))
+            self.assertEqual(
+                ghdecoy.get_script_size(conf, data, backend),
+                os.path.getsize(self.outfile))
+
+    def test_get_backend_costs(self):
+        conf = ghdecoy.parse_args(['./ghdecoy.py', '-l', 'raw', 'fill'])
+        costs = ghdecoy.get_backend_costs(conf, (1, 3), (1, 2))
+        self.assertItemsEqual(costs.keys(),
+                              ghdecoy.known_backends + ['bytes'])
+        for per_commit, overhead in costs.values():
+            self.assertGreaterEqual(per_commit, 0)
+            self.assertGreaterEqual(overhead, 0)
+        self.assertGreater(costs['bytes'][0], 0)
+        self.assertIs(ghdecoy.get_backend_costs(conf), costs)
+
+    def test_run_estimate(self):
+        wdir = '/tmp/ghdecoy-test-estimate'
+        shutil.rmtree(wdir, True)
+        os.makedirs(wdir)
+        conf = ghdecoy.parse_args(['./ghdecoy.py', '-u', 'tickelton', '-d',
+                                   wdir, '-m', '1', '--estimate', 'fill'])
+        ghdecoy.backend_costs[conf['lang']] = dict(
+            (key, (0.0, 0.0)) for key in ghdecoy.known_backends + ['bytes'])
+        cal = ghdecoy.Calendar(datetime.date(2016, 1, 1).toordinal(),
+                               [1, 0, 0, 0, 1])
+        try:
+            ret = ghdecoy.run(conf, cal)[0]
+            created = os.listdir(wdir)
+        finally:
+            del ghdecoy.backend_costs[conf['lang']]
+            shutil.rmtree(wdir, True)
+        self.assertEqual(ret, 0)
+        self.assertListEqual(created, [])
+
+    def test_parse_timeframe_arg_file(self):
+        path = '/tmp/ghdecoy-test-timeframe'
+        with open(path, 'w') as frame_fo:
+            frame_fo.write('# vacation\n2016-03-01..2016-03-02, 20160305\n'
+                           '20160307 20160308\n')
+        conf = {}
+        try:
+            self.assertTrue(ghdecoy.parse_timeframe_arg('@' + path, conf))
+        finally:
+            os.remove(path)
+        self.assertDictEqual(conf, {'timeframe': {
+            'singledates': [
+                datetime.datetime(2016, 3, 5, 12, 0),
+                datetime.datetime(2016, 3, 7, 12, 0),
+                datetime.datetime(2016, 3, 8, 12, 0),
+            ],
+            'intervals': [[
+                datetime.datetime(2016, 3, 1, 12, 0),
+                datetime.datetime(2016, 3, 2, 12, 0)
+            ]]
+        }})
+
+    def test_parse_timeframe_arg_missing_file(self):
+        conf = {}
+        self.assertFalse(ghdecoy.parse_timeframe_arg(
+            '@/tmp/ghdecoy-test-missing', conf))
+        self.assertDictEqual(conf, {})
+
+    def test_parse_holidays_arg_invalid(self):
+        path = '/tmp/ghdecoy-test-holidays'
+        with open(path, 'w') as holidays_fo:
+            holidays_fo.write('20161225\n20161332\n')
+        conf = {}
+        try:
+            self.assertFalse(ghdecoy.parse_holidays_arg(path, conf))
+        finally:
+            os.remove(path)
+        self.assertDictEqual(conf, {})
+
     @classmethod
     def tearDownClass(cls):
         os.remove(cls.outfile)
 
 
+class GHDecoyFetchTests(unittest.TestCase):
+    """Unit tests for 'ghdecoy.py' that fetch data from a local HTTP server"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = CalendarServer(('127.0.0.1', 0), CalendarHandler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+        cls.base_url = 'http://127.0.0.1:{0}'.format(cls.server.server_port)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        CalendarHandler.connections = 0
+        CalendarHandler.requests = []
+
+    def test_fetch(self):
+        fetcher = ghdecoy.CalendarFetcher(self.base_url, 5)
+        cal = fetcher.fetch('alice')
+        self.assertListEqual(cal, make_calendar_page())
+        self.assertTrue(ghdecoy.calendar_valid(cal))
+
+    def test_fetch_encodings(self):
+        fetcher = ghdecoy.CalendarFetcher(self.base_url, 5)
+        for user in ('gzip', 'zlib', 'deflate', 'plain'):
+            self.assertListEqual(fetcher.fetch(user), make_calendar_page())
+        self.assertEqual(CalendarHandler.requests[0][1]['accept-encoding'],
+                         'gzip, deflate')
+
+    def test_fetch_counts_bytes(self):
+        fetcher = ghdecoy.CalendarFetcher(self.base_url, 5)
+        fetcher.get_contributions('alice')
+        size = len(''.join(make_calendar_page()))
+        self.assertEqual(fetcher.data_bytes, size)
+        self.assertLess(fetcher.wire_bytes, size / 4)
+        fetcher.get_contributions('plain')
+        self.assertEqual(fetcher.data_bytes, 2 * size)
+        self.assertGreater(fetcher.wire_bytes, size)
+
+    def test_fetch_reuses_connection(self):
+        fetcher = ghdecoy.CalendarFetcher(self.base_url, 5)
+        for user in ('alice', 'bob', 'carol'):
+            self.assertTrue(fetcher.fetch(user))
+        self.assertEqual(CalendarHandler.connections, 1)
+        self.assertEqual(len(CalendarHandler.requests), 3)
+
+    def test_fetch_not_found(self):
+        fetcher = ghdecoy.CalendarFetcher(self.base_url, 5)
+        self.assertIsNone(fetcher.fetch('missing'))
+
+    def test_fetch_redirect(self):
+        fetcher = ghdecoy.CalendarFetcher(self.base_url, 5)
+        resp = fetcher.request(self.base_url + '/redirect')
+        self.assertEqual(resp.status, 200)
+        self.assertEqual(resp.read(), ''.join(make_calendar_page()))
+
+    def test_fetch_many(self):
+        fetcher = ghdecoy.CalendarFetcher(self.base_url, 5)
+        users = ['user{0}'.format(i) for i in range(20)] + ['missing']
+        cals = fetcher.fetch_many(users, 4)
+        self.assertEqual(len(cals), 21)
+        self.assertIsNone(cals['missing'])
+        data = ghdecoy.parse_calendar(make_calendar_page())
+        for i in range(20):
+            self.assertEqual(cals['user{0}'.format(i)], data)
+        self.assertLessEqual(CalendarHandler.connections, 4)
+
+    def test_get_calendar_base_url(self):
+        conf = ghdecoy.parse_args(
+            ['./ghdecoy.py', '-u', 'alice', '--base-url', self.base_url,
+             '--timeout', '5', 'fill'])
+        cal = ghdecoy.get_calendar(conf['user'], ghdecoy.get_fetcher(conf))
+        self.assertListEqual(cal, make_calendar_page())
+        self.assertEqual(CalendarHandler.requests[0][0],
+                         '/users/alice/contributions')
+
+
+    def test_get_contributions(self):
+        fetcher = ghdecoy.CalendarFetcher(self.base_url, 5)
+        data = fetcher.get_contributions('alice')
+        self.assertEqual(len(data), 371)
+        self.assertEqual(data, ghdecoy.parse_calendar(make_calendar_page()))
+
+    def test_get_contributions_invalid(self):
+        fetcher = ghdecoy.CalendarFetcher(self.base_url, 5)
+        self.assertIsNone(fetcher.get_contributions('missing'))
+
+    def test_open_streams_chunks(self):
+        fetcher = ghdecoy.CalendarFetcher(self.base_url, 5)
+        chunks = list(fetcher.open('alice', 1024))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(''.join(chunks), ''.join(make_calendar_page()))
+
+    def test_open_abandoned_stream(self):
+        fetcher = ghdecoy.CalendarFetcher(self.base_url, 5)
+        chunks = fetcher.open('alice', 1024)
+        next(chunks)
+        chunks.close()
+        self.assertListEqual(fetcher.fetch('bob'), make_calendar_page())
+
+    def test_fetch_cache_hit(self):
+        cache_dir = '/tmp/ghdecoy-test-cache'
+        shutil.rmtree(cache_dir, True)
+        try:
+            cache = ghdecoy.CalendarCache(cache_dir, ttl=3600)
+            fetcher = ghdecoy.CalendarFetcher(self.base_url, 5, cache)
+            first = fetcher.fetch('alice')
+            second = fetcher.fetch('alice')
+        finally:
+            shutil.rmtree(cache_dir, True)
+        self.assertListEqual(first, make_calendar_page())
+        self.assertListEqual(second, first)
+        self.assertEqual(len(CalendarHandler.requests), 1)
+
+    def test_fetch_cache_revalidate(self):
+        cache_dir = '/tmp/ghdecoy-test-cache'
+        shutil.rmtree(cache_dir, True)
+        try:
+            cache = ghdecoy.CalendarCache(cache_dir, ttl=0)
+            fetcher = ghdecoy.CalendarFetcher(self.base_url, 5, cache)
+            first = fetcher.fetch('alice')
+            second = fetcher.fetch('alice')
+        finally:
+            shutil.rmtree(cache_dir, True)
+        self.assertListEqual(second, first)
+        self.assertEqual(len(CalendarHandler.requests), 2)
+        self.assertNotIn('if-none-match', CalendarHandler.requests[0][1])
+        self.assertEqual(CalendarHandler.requests[1][1]['if-none-match'],
+                         '"v1"')
+
+
+    def test_fetch_many_cache_evict(self):
+        cache_dir = '/tmp/ghdecoy-test-cache'
+        shutil.rmtree(cache_dir, True)
+        try:
+            cache = ghdecoy.CalendarCache(cache_dir, max_age=60)
+            cache.put('old', 'data', {})
+            for path in cache.get_paths('old'):
+                os.utime(path, (1000, 1000))
+            fetcher = ghdecoy.CalendarFetcher(self.base_url, 5, cache)
+            cals = fetcher.fetch_many(['alice', 'bob'], 2)
+            old = cache.get('old')
+            alice = cache.get('alice')
+        finally:
+            shutil.rmtree(cache_dir, True)
+        self.assertEqual(len(cals), 2)
+        self.assertTupleEqual(old, (None, None))
+        self.assertIsNotNone(alice[0])
+
 class GHDecoyMiscTests(unittest.TestCase):
     """Miscellaneous unit tests for 'ghdecoy.py'
 
@@ -243,6 +1126,154 @@ class GHDecoyMiscTests(unittest.TestCase):
         )
         self.assertEqual(conf['action'], 'timeframe')
 
+    def test_parse_args_backend(self):
+        conf = ghdecoy.parse_args(
+            ['./ghdecoy.py', '-u', 'tickelton', '-b', 'fast-import', 'fill'])
+        self.assertEqual(conf['backend'], 'fast-import')
+
+    def test_parse_args_invalid_backend(self):
+        with self.assertRaisesRegexp(SystemExit, '^1$'):
+            ghdecoy.parse_args(
+                ['./ghdecoy.py', '-u', 'tickelton', '-b', 'foobar', 'fill'])
+
+    def test_parse_args_batch(self):
+        conf = ghdecoy.parse_args(
+            ['./ghdecoy.py', '-n', '-l', 'c', '--batch', 'users.txt',
+             '--jobs', '8'])
+        self.assertEqual(conf['batch'], 'users.txt')
+        self.assertEqual(conf['jobs'], 8)
+        self.assertListEqual(conf['args'], ['-n', '-lc'])
+
+    def test_parse_batch(self):
+        conf = ghdecoy.parse_args(
+            ['./ghdecoy.py', '-n', '-l', 'c', '-d', '/fake/dir',
+             '--batch', '-'])
+        jobs = ghdecoy.parse_batch(conf, [
+            '# comment\n',
+            '\n',
+            '-u alice fill\n',
+            '-u bob -r other -l ruby -w 20160301-20160305\n',
+            '-u carol foo\n',
+        ])
+        self.assertEqual(len(jobs), 3)
+        alice = jobs[0][1]
+        self.assertEqual(alice['user'], 'alice')
+        self.assertEqual(alice['action'], 'fill')
+        self.assertEqual(alice['lang'], 'c')
+        self.assertTrue(alice['dryrun'])
+        self.assertEqual(alice['wdir'], '/fake/dir/alice_decoy')
+        bob = jobs[1][1]
+        self.assertEqual(bob['repo'], 'other')
+        self.assertEqual(bob['lang'], 'ruby')
+        self.assertTrue(bob['workday'])
+        self.assertEqual(bob['action'], 'timeframe')
+        self.assertEqual(bob['wdir'], '/fake/dir/bob_other')
+        self.assertEqual(jobs[2], ('-u carol foo', None))
+
+    def test_parse_batch_long_options(self):
+        conf = ghdecoy.parse_args(
+            ['./ghdecoy.py', '--seed-salt', '', '--incremental', '--batch',
+             '-'])
+        self.assertListEqual(conf['args'], ['--seed-salt=', '--incremental'])
+        stdout = ghdecoy.sys.stdout
+        ghdecoy.sys.stdout = StringIO.StringIO()
+        try:
+            jobs = ghdecoy.parse_batch(conf, ['-u alice fill',
+                                              '-u bob --bogus fill'])
+            output = ghdecoy.sys.stdout.getvalue()
+        finally:
+            ghdecoy.sys.stdout = stdout
+        self.assertEqual(jobs[0][1]['seed_salt'], '')
+        self.assertTrue(jobs[0][1]['incremental'])
+        self.assertIsNone(jobs[1][1])
+        self.assertEqual(output, 'option --bogus not recognized\n')
+
+    def test_render_content_raw(self):
+        self.assertEqual(ghdecoy.render_content('raw', 7), '7\n')
+
+    def test_render_content_c(self):
+        self.assertEqual(ghdecoy.render_content('c', 3),
+                         '#include <stdio.h>\n'
+                         '#include <stdlib.h>\n'
+                         '\n'
+                         'int main(void)\n'
+                         '{\n'
+                         '  puts("Hello World3!");\n'
+                         '  return EXIT_SUCCESS;\n'
+                         '}\n')
+
+    def test_iter_commits(self):
+        data = [
+            {'date': '2015-01-01T12:00:00', 'count': 2},
+            {'date': '2015-01-02T12:00:00', 'count': 0},
+            {'date': '2015-01-03T12:00:00', 'count': 1},
+        ]
+        self.assertListEqual(list(ghdecoy.iter_commits(data)), [
+            ('2015-01-01T12:00:00', 0),
+            ('2015-01-01T12:00:00', 1),
+            ('2015-01-03T12:00:00', 2),
+        ])
+
+    def test_iter_commits_variants(self):
+        data = [
+            {'date': '2015-01-01T12:00:00', 'count': 3},
+            {'date': '2015-01-02T12:00:00', 'count': 2},
+        ]
+        self.assertListEqual([j for date, j in ghdecoy.iter_commits(
+            data, 2, 3)], [2, 0, 1, 2, 0])
+
+    def test_write_fast_import(self):
+        conf = {'lang': 'raw'}
+        data = [
+            {'date': '2015-01-01T12:00:00', 'count': 1},
+        ]
+        stream = StringIO.StringIO()
+        ghdecoy.write_fast_import(conf, data, 'A <a@b>', 'C <c@d>', stream)
+        git_date = ghdecoy.get_git_date('2015-01-01T12:00:00')
+        self.assertEqual(stream.getvalue(),
+                         'commit refs/heads/master\n'
+                         'author A <a@b> ' + git_date + '\n'
+                         'committer C <c@d> ' + git_date + '\n'
+                         'data 8\nghdecoy\n'
+                         'M 100644 inline decoy\n'
+                         'data 2\n0\n\n')
+
+    def test_calendar_parser_chunks(self):
+        page = ''.join(make_calendar_page())
+        parser = ghdecoy.CalendarParser()
+        chunks = [page[i:i + 7] for i in range(0, len(page), 7)]
+        data = ghdecoy.Calendar.from_days(parser.parse(chunks))
+        self.assertTrue(parser.valid)
+        self.assertEqual(data, ghdecoy.parse_calendar(make_calendar_page()))
+
+    def test_calendar_parser_feed(self):
+        ordinal = datetime.date(2015, 1, 1).toordinal()
+        parser = ghdecoy.CalendarParser()
+        self.assertListEqual(parser.feed('<rect data-count="3" '), [])
+        self.assertListEqual(
+            parser.feed('data-date="2015-01-01"/><rect data-count='),
+            [(ordinal, 3)])
+        self.assertListEqual(parser.feed('"1" data-date="2015-01-02"/>'),
+                             [(ordinal + 1, 1)])
+        self.assertListEqual(parser.close(), [])
+        self.assertFalse(parser.valid)
+
+    def test_calendar_parser_attribute_order(self):
+        parser = ghdecoy.CalendarParser()
+        data = parser.feed(
+            '<rect data-date="2015-01-01" fill="#eee" data-count="2"/>\n'
+            '<rect class="day"\n data-count="5"\n data-date="2015-01-02"/>')
+        ordinal = datetime.date(2015, 1, 1).toordinal()
+        self.assertListEqual(data, [(ordinal, 2), (ordinal + 1, 5)])
+
+    def test_calendar_parser_day_count(self):
+        parser = ghdecoy.CalendarParser()
+        list(parser.parse(make_calendar_page(days=364)))
+        self.assertFalse(parser.valid)
+        parser = ghdecoy.CalendarParser()
+        list(parser.parse(make_calendar_page(days=365)))
+        self.assertTrue(parser.valid)
+
     def test_parse_calendar(self):
         data = ['<svg width="721" height="110" class="js-calendar-graph-svg">',
                 '<g transform="translate(20, 20)">',
@@ -307,7 +1338,8 @@ class GHDecoyMiscTests(unittest.TestCase):
             {'date': '2015-01-05T12:00:00', 'count': 0},
         ]
         ret = ghdecoy.create_dataset(data, 'fill', 1, 4, False, [], False)
-        self.assertListEqual([], ret)
+        self.assertEqual(1, len(ret))
+        self.assertDictContainsSubset({'date': '2015-01-05T12:00:00'}, ret[0])
 
     def test_create_dataset_fill_gap_to_small(self):
         data = [
@@ -380,7 +1412,8 @@ class GHDecoyMiscTests(unittest.TestCase):
             {'date': '2015-01-05T12:00:00', 'count': 0},
         ]
         ret = ghdecoy.create_dataset(data, 'append', 1, 4, False, [], False)
-        self.assertListEqual([], ret)
+        self.assertEqual(1, len(ret))
+        self.assertDictContainsSubset({'date': '2015-01-05T12:00:00'}, ret[0])
 
     def test_create_dataset_append_gap_to_small(self):
         data = [
@@ -436,9 +1469,112 @@ class GHDecoyMiscTests(unittest.TestCase):
                 datetime.datetime(2005, 3, 9, 12, 0)
             ]]
         }, False)
-        self.assertDictContainsSubset({'date': '2005-03-09T12:00:00'}, ret[0])
+        self.assertDictContainsSubset({'date': '2005-03-07T12:00:00'}, ret[0])
         self.assertDictContainsSubset({'date': '2005-03-08T12:00:00'}, ret[1])
-        self.assertDictContainsSubset({'date': '2005-03-07T12:00:00'}, ret[2])
+        self.assertDictContainsSubset({'date': '2005-03-09T12:00:00'}, ret[2])
+
+    def test_create_dataset_timeframe_clipped_workday(self):
+        data = [
+            {'date': '2016-11-04T12:00:00', 'count': 0},
+            {'date': '2016-11-05T12:00:00', 'count': 0},
+            {'date': '2016-11-06T12:00:00', 'count': 0},
+            {'date': '2016-11-07T12:00:00', 'count': 0},
+        ]
+        ret = ghdecoy.create_dataset(data, 'timeframe', 3, 4, False, {
+            'singledates': [
+                datetime.datetime(2016, 11, 5, 12, 0),
+                datetime.datetime(2017, 1, 1, 12, 0),
+            ],
+            'intervals': [[
+                datetime.datetime(2000, 1, 1, 12, 0),
+                datetime.datetime(2030, 1, 1, 12, 0)
+            ]]
+        }, True)
+        self.assertListEqual([entry['date'] for entry in ret], [
+            '2016-11-04T12:00:00',
+            '2016-11-05T12:00:00',
+            '2016-11-07T12:00:00',
+        ])
+
+    def test_create_dataset_timeframe_overlapping(self):
+        data = [
+            {'date': '2016-11-04T12:00:00', 'count': 0},
+            {'date': '2016-11-05T12:00:00', 'count': 0},
+            {'date': '2016-11-06T12:00:00', 'count': 0},
+            {'date': '2016-11-07T12:00:00', 'count': 0},
+        ]
+        ret = ghdecoy.create_dataset(data, 'timeframe', 3, 4, False, {
+            'singledates': [datetime.datetime(2016, 11, 5, 12, 0)],
+            'intervals': [[
+                datetime.datetime(2016, 11, 6, 12, 0),
+                datetime.datetime(2016, 11, 7, 12, 0)
+            ], [
+                datetime.datetime(2016, 11, 4, 12, 0),
+                datetime.datetime(2016, 11, 6, 12, 0)
+            ]]
+        }, False)
+        self.assertListEqual([entry['date'] for entry in ret], [
+            '2016-11-04T12:00:00',
+            '2016-11-05T12:00:00',
+            '2016-11-06T12:00:00',
+            '2016-11-07T12:00:00',
+        ])
+
+    def test_merge_intervals(self):
+        self.assertListEqual(ghdecoy.merge_intervals(
+            [(10, 12), (1, 3), (4, 4), (11, 15), (7, 8), (13, 14)]),
+            [(1, 4), (7, 8), (10, 15)])
+
+    def test_calendar_from_entries(self):
+        data = [
+            {'date': '2016-02-28T12:00:00', 'count': 3},
+            {'date': '2016-02-29T12:00:00', 'count': -1},
+            {'date': '2016-03-02T12:00:00', 'count': 5},
+        ]
+        cal = ghdecoy.Calendar.from_entries(data)
+        self.assertEqual(cal.start, datetime.date(2016, 2, 28).toordinal())
+        self.assertListEqual(list(cal.counts), [3, 0, 0, 5])
+        self.assertDictEqual(cal[3], {'date': '2016-03-02T12:00:00',
+                                      'count': 5})
+        self.assertDictEqual(cal[-2], {'date': '2016-03-01T12:00:00',
+                                       'count': 0})
+
+    def test_calendar_slice_index_weekday(self):
+        start = datetime.date(2016, 11, 1).toordinal()
+        cal = ghdecoy.Calendar(start, range(10))
+        part = cal[2:5]
+        self.assertEqual(part.start, start + 2)
+        self.assertListEqual(list(part.counts), [2, 3, 4])
+        self.assertEqual(part.get_date(0), '2016-11-03T12:00:00')
+        self.assertEqual(cal.index(start + 9), 9)
+        self.assertIsNone(cal.index(start + 10))
+        self.assertIsNone(cal.index(start - 1))
+        self.assertListEqual([cal.weekday(i) for i in range(7)],
+                             [2, 3, 4, 5, 6, 7, 1])
+
+    def test_create_dataset_force_includes_last_day(self):
+        data = [
+            {'date': '2015-01-01T12:00:00', 'count': 1},
+            {'date': '2015-01-02T12:00:00', 'count': 1},
+            {'date': '2015-01-03T12:00:00', 'count': 1},
+        ]
+        ret = ghdecoy.create_dataset(data, 'fill', 1, 4, True, [], False)
+        self.assertEqual(3, len(ret))
+        self.assertDictContainsSubset({'date': '2015-01-03T12:00:00'}, ret[2])
+
+    def test_find_gaps(self):
+        self.assertListEqual([], ghdecoy.find_gaps([1, 2, 3]))
+        self.assertListEqual([(0, 2), (3, 1), (5, 2)],
+                             ghdecoy.find_gaps([0, 0, 1, 0, 4, 0, 0]))
+
+    def test_select_gaps(self):
+        gaps = [(0, 2), (3, 1), (5, 2)]
+        self.assertListEqual([(0, 2), (5, 2)],
+                             ghdecoy.select_gaps(gaps, 'fill', 2, 7))
+        self.assertListEqual([(5, 2)],
+                             ghdecoy.select_gaps(gaps, 'append', 1, 7))
+        self.assertListEqual([],
+                             ghdecoy.select_gaps(gaps, 'append', 1, 8))
 
     def test_create_dataset_timeframe_empty(self):
         data = [
@@ -465,10 +1601,9 @@ class GHDecoyMiscTests(unittest.TestCase):
             'git add decoy{1}\n'
             '{2}\n'
             'git remote add origin https://github.com/{3}/$REPO.git\n'
-            'set +e\n'
-            'git pull\n'
-            'set -e\n'
-            'git push -f -u origin master\n'
+            'git push --force-with-lease=master:'
+            '$(git ls-remote origin refs/heads/master | cut -f1) '
+            '-u origin master\n'
         )
         ret = ghdecoy.create_template(conf)
         self.assertEqual(result, ret)
@@ -488,9 +1623,6 @@ class GHDecoyMiscTests(unittest.TestCase):
             'git add decoy{1}\n'
             '{2}\n'
             'git remote add origin git@github.com:{3}/$REPO.git\n'
-            'set +e\n'
-            'git pull\n'
-            'set -e\n'
         )
         ret = ghdecoy.create_template(conf)
         self.assertEqual(result, ret)
@@ -1188,5 +2320,173 @@ class GHDecoyMiscTests(unittest.TestCase):
             ]]
         }})
 
+    def test_parse_date_entry(self):
+        first = datetime.date(2016, 2, 28).toordinal()
+        self.assertTupleEqual(ghdecoy.parse_date_entry('20160228'),
+                              (first, first))
+        self.assertTupleEqual(ghdecoy.parse_date_entry('2016-02-28'),
+                              (first, first))
+        for entry in ('20160228-20160301', '2016-02-28..2016-03-01',
+                      '2016-02-28/20160301'):
+            self.assertTupleEqual(ghdecoy.parse_date_entry(entry),
+                                  (first, first + 2))
+
+    def test_parse_date_entry_invalid(self):
+        for entry in ('', '2016022', '20160230', '20160301-20160228',
+                      '20160228-', '2016-02-28 20160301'):
+            self.assertIsNone(ghdecoy.parse_date_entry(entry))
+
+    def test_get_day_mask(self):
+        cal = ghdecoy.Calendar(datetime.date(2016, 11, 4).toordinal(),
+                               [0] * 7)
+        self.assertEqual(ghdecoy.get_day_mask(cal, False, []),
+                         bytearray([1, 1, 1, 1, 1, 1, 1]))
+        self.assertEqual(ghdecoy.get_day_mask(cal, True, []),
+                         bytearray([1, 0, 0, 1, 1, 1, 1]))
+        holidays = [
+            ghdecoy.parse_date_entry('20161101-20161104'),
+            ghdecoy.parse_date_entry('20161109'),
+        ]
+        self.assertEqual(ghdecoy.get_day_mask(cal, True, holidays),
+                         bytearray([0, 0, 0, 1, 1, 0, 1]))
+
+    def test_create_dataset_holidays(self):
+        data = [
+            {'date': '2016-11-04T12:00:00', 'count': 1},
+            {'date': '2016-11-05T12:00:00', 'count': 0},
+            {'date': '2016-11-06T12:00:00', 'count': 0},
+            {'date': '2016-11-07T12:00:00', 'count': 0},
+            {'date': '2016-11-08T12:00:00', 'count': 0},
+        ]
+        holidays = [ghdecoy.parse_date_entry('20161106-20161107')]
+        ret = ghdecoy.create_dataset(data, 'fill', 3, 4, False, {}, False,
+                                     holidays)
+        self.assertListEqual([entry['date'] for entry in ret], [
+            '2016-11-05T12:00:00',
+            '2016-11-08T12:00:00',
+        ])
+
+    def test_create_dataset_holidays_singledates(self):
+        data = [
+            {'date': '2016-11-04T12:00:00', 'count': 1},
+            {'date': '2016-11-05T12:00:00', 'count': 0},
+            {'date': '2016-11-06T12:00:00', 'count': 0},
+            {'date': '2016-11-07T12:00:00', 'count': 0},
+            {'date': '2016-11-08T12:00:00', 'count': 0},
+        ]
+        timeframe = {'intervals': [], 'singledates': [
+            datetime.date(2016, 11, day) for day in (5, 6, 7, 8)]}
+        holidays = [ghdecoy.parse_date_entry('20161106-20161107')]
+        ret = ghdecoy.create_dataset(data, 'timeframe', 1, 4, False,
+                                     timeframe, True, holidays)
+        self.assertListEqual([entry['date'] for entry in ret], [
+            '2016-11-05T12:00:00',
+            '2016-11-08T12:00:00',
+        ])
+
+    def test_get_shade_counts(self):
+        self.assertListEqual(ghdecoy.get_shade_counts([0, 0]),
+                             [0, 1, 2, 3, 4])
+        self.assertListEqual(
+            ghdecoy.get_shade_counts([0, 1, 2, 3, 4, 5, 6, 7, 8, 400]),
+            [0, 1, 4, 6, 8])
+        self.assertListEqual(ghdecoy.get_shade_counts([0, 5, 5, 5]),
+                             [0, 1, 6, 7, 8])
+
+    def test_shade_scale(self):
+        cal = ghdecoy.Calendar(datetime.date(2016, 1, 1).toordinal(),
+                               [2, 4, 6, 8, 400, 0, 0, 0, 0])
+        data_out = [
+            {'date': '2016-01-06T12:00:00', 'count': 0},
+            {'date': '2016-01-07T12:00:00', 'count': 1},
+            {'date': '2016-01-08T12:00:00', 'count': 2},
+            {'date': '2016-01-09T12:00:00', 'count': 4},
+        ]
+        commits, scaled = ghdecoy.shade_scale(cal, data_out)
+        self.assertEqual(scaled, 700)
+        self.assertEqual(commits, sum(entry['count'] for entry in data_out))
+        shade_counts = ghdecoy.get_shade_counts(
+            list(cal.counts[:5]) + [entry['count'] for entry in data_out])
+        self.assertListEqual([entry['count'] for entry in data_out],
+                             [0, shade_counts[1], shade_counts[2],
+                              shade_counts[4]])
+
+    def test_shade_scale_empty_calendar(self):
+        cal = ghdecoy.Calendar(datetime.date(2015, 1, 4).toordinal(),
+                               [0] * 371)
+        data_out = ghdecoy.create_dataset(cal, 'fill', 5, 4, False, {},
+                                          False, (), None, 'x')
+        shades = [entry['count'] for entry in data_out]
+        commits, scaled = ghdecoy.shade_scale(cal, data_out)
+        self.assertLessEqual(commits, scaled)
+        self.assertListEqual([entry['count'] for entry in data_out], shades)
+
+    def test_shade_scale_sparse_calendar(self):
+        counts = [0] * 371
+        for idx in range(0, 371, 10):
+            counts[idx] = idx % 40 + 1
+        cal = ghdecoy.Calendar(datetime.date(2015, 1, 4).toordinal(),
+                               counts)
+        data_out = [{'date': cal.get_date(idx), 'count': i % 5}
+                    for i, idx in enumerate(range(1, 371, 10))]
+        commits, scaled = ghdecoy.shade_scale(cal, data_out)
+        self.assertLessEqual(commits, scaled)
+        self.assertEqual(commits, sum(entry['count'] for entry in data_out))
+        shade_counts = ghdecoy.get_shade_counts(
+            [count for count in counts if count] +
+            [entry['count'] for entry in data_out])
+        self.assertListEqual([entry['count'] for entry in data_out[:5]],
+                             shade_counts)
+
+    def test_create_dataset_shade_planner(self):
+        counts = [1, 2, 3, 5, 8] * 8 + [400] + [0] * 10
+        cal = ghdecoy.Calendar(datetime.date(2016, 1, 1).toordinal(), counts)
+        ret = ghdecoy.create_dataset(cal, 'fill', 3, 4, False, {}, False,
+                                     (), 'shade')
+        self.assertEqual(len(ret), 10)
+        planned = [entry['count'] for entry in ret]
+        shade_counts = ghdecoy.get_shade_counts(counts[:41] + planned)
+        for count in planned:
+            self.assertIn(count, shade_counts)
+        self.assertLessEqual(max(planned), 9)
+
+    def test_parse_args_planner(self):
+        conf = ghdecoy.parse_args(
+            ['./ghdecoy.py', '--planner', 'shade', 'fill'])
+        self.assertEqual(conf['planner'], 'shade')
+        with self.assertRaises(SystemExit):
+            ghdecoy.parse_args(['./ghdecoy.py', '--planner', 'foo', 'fill'])
+
+    def test_get_seed(self):
+        seed = ghdecoy.get_seed('tickelton', 'decoy')
+        self.assertEqual(seed, ghdecoy.get_seed('tickelton', 'decoy', ''))
+        self.assertNotEqual(seed, ghdecoy.get_seed('tickelton', 'decoy', 'x'))
+        self.assertNotEqual(seed, ghdecoy.get_seed('tickelton', 'decoy2'))
+
+    def test_get_day_random(self):
+        values = [ghdecoy.get_day_random('seed', ordinal)
+                  for ordinal in range(1000)]
+        self.assertEqual(values[5], ghdecoy.get_day_random('seed', 5))
+        self.assertGreaterEqual(min(values), 0)
+        self.assertLess(max(values), 1)
+        self.assertGreater(len(set(values)), 990)
+
+    def test_create_dataset_seeded(self):
+        data = [{'date': '2016-01-01T12:00:00', 'count': 4}] + [
+            {'date': '2016-01-%02dT12:00:00' % day, 'count': 0}
+            for day in range(2, 32)]
+        seed = ghdecoy.get_seed('tickelton', 'decoy')
+        fill = ghdecoy.create_dataset(data, 'fill', 1, 4, False, {}, False,
+                                      (), 'scale', seed)
+        self.assertListEqual(fill, ghdecoy.create_dataset(
+            data, 'fill', 1, 4, False, {}, False, (), 'scale', seed))
+        force = ghdecoy.create_dataset(data, 'fill', 1, 4, True, {}, False,
+                                       (), 'scale', seed)
+        self.assertListEqual(fill, force[1:])
+        other = ghdecoy.create_dataset(
+            data, 'fill', 1, 4, False, {}, False, (), 'scale',
+            ghdecoy.get_seed('tickelton', 'decoy', 'salt'))
+        self.assertNotEqual(fill, other)
+
 if __name__ == '__main__':
     unittest.main(buffer=True)